@@ -1,107 +1,268 @@
+import os
 import accounts
+import checkpoint as ckpt
 from model import ARIMA
 import recorder
 import evaluator
+import pyramid
+from settlement import settle
 import utils
+import numpy as np
 import pandas as pd
 
+# Record layout of the binary price stores (<region>-token.bin) kept by
+# data/scripts/download_token.py
+PRICE_DTYPE = np.dtype([("time", "<i8"), ("price", "<f8")])
 
-def get_data(file):
-	fp = utils.PathFinder2.search(file)
+
+def _epoch(times):
+	# "YYYY-MM-DD HH:MM:SS" strings to epoch seconds. numpy parses these directly;
+	# anything it doesn't take goes through pandas.
+	try:
+		return times.astype("datetime64[s]").astype(np.int64)
+	except ValueError:
+		return pd.to_datetime(times).to_numpy().astype("datetime64[s]").astype(np.int64)
+
+
+def read_blocks(file, chunksize=1 << 16, start=0):
+	'''
+	Stream a price file as blocks of (time, price, pdelta) arrays, with time in epoch
+	seconds. Only 'chunksize' rows are parsed at a time, and pdelta carries across
+	block boundaries. The first row only gives the first pdelta and is skipped,
+	like get_data always did. 'start' skips that many more rows.
+
+	CSV files are parsed with fixed columns and dtypes. Binary stores (.bin) are
+	read from the memory-mapped file.
+	'''
+	if file.endswith(".bin"):
+		store = open_store(file)
+		chunks = ((store["time"][i:i+chunksize], store["price"][i:i+chunksize])
+				for i in range(0, len(store), chunksize))
+	else:
+		reader = pd.read_csv(file, usecols=["time", "price"], dtype={"time": str, "price": np.float64},
+							chunksize=chunksize)
+		chunks = ((_epoch(chunk["time"].to_numpy()), chunk["price"].to_numpy()) for chunk in reader)
+
+	prior = None
+	skip = start + 1
+	for time, price in chunks:
+		if prior is None:
+			pdelta = np.diff(price, prepend=np.nan)
+		else:
+			pdelta = np.diff(price, prepend=prior)
+		if len(price):
+			prior = price[-1]
+
+		if skip:
+			n = min(skip, len(price))
+			skip -= n
+			time, price, pdelta = time[n:], price[n:], pdelta[n:]
+		if len(price):
+			yield time, price, pdelta
+
+
+def get_data(file, resolution=None, start=0):
+	'''
+	Rows of (time, price, pdelta), read lazily. Times are epoch seconds.
+	start: number of rows to skip
+	'''
+	fp = utils.PathResolver().search(file)
+	utils.os.chdir(fp)
+
+	if resolution is not None:
+		# Close prices of the resampled bars
+		bars = pyramid.load(file, resolution)
+		close = np.asarray(bars["close"])
+		return zip(bars["time"][1+start:].tolist(), close[1+start:].tolist(), np.diff(close)[start:].tolist())
+
+	return _ticks(read_blocks(file, start=start))
+
+
+def _ticks(blocks):
+	for time, price, pdelta in blocks:
+		yield from zip(time.tolist(), price.tolist(), pdelta.tolist())
+
+
+def open_store(file):
+	'''
+	Memory-map a binary price store. Nothing is read until the records are used.
+	'''
+	fp = utils.PathResolver().search(file, filepath=True)
+	if fp is None:
+		raise utils.PathError(f"{file} not found")
+	return np.memmap(fp, dtype=PRICE_DTYPE, mode="r")
+
+
+def get_series(file, resolution=None):
+	# Same rows as get_data, but as (time, price) arrays for engine.backtest, with
+	# time as epoch seconds. CSV files are parsed block by block with read_blocks.
+	# Binary stores (.bin) are returned as views of the memory-mapped file. A
+	# resolution returns the close prices of that pyramid level.
+	fp = utils.PathResolver().search(file)
 	utils.os.chdir(fp)
 
-	with open(file, "r") as f:
-		df = pd.read_csv(f, index_col='time', infer_datetime_format=True)
-		df['pdelta'] = df['price'].diff(periods=1)
-		df.drop(df.index[0], inplace=True)
-	
-	return df.itertuples()
+	if resolution is not None:
+		bars = pyramid.load(file, resolution)
+		return bars["time"][1:], bars["close"][1:]
+
+	if file.endswith(".bin"):
+		store = open_store(file)
+		return store["time"][1:], store["price"][1:]
+
+	blocks = list(read_blocks(file))
+	if not blocks:
+		return np.empty(0, dtype=np.int64), np.empty(0)
+	time = np.concatenate([block[0] for block in blocks])
+	price = np.concatenate([block[1] for block in blocks])
+	return time, price
 
 
-def algo(file, start_regional, region, start_gold, token, outfile):
+def algo(file, start_regional, region, start_gold, token, outfile, mode="csv", profiler=None, records=None,
+		checkpoint=None, every=10000, resolution=None, summary=False):
+	'''
+	resolution: trade the close prices of a resampled level of the price file
+	(a pyramid.RESOLUTIONS key, e.g. "1h") instead of every tick
+	records: optional recorder to use instead of a recorder.Batch writing to
+	outfile, e.g. a recorder.History. Decision objects are reused between ticks, so
+	a recorder has to copy what it keeps.
+	profiler: optional profiler.Profiler. Each tick's time is split into its
+	predict, evaluate, optimize, settle and record stages, and the summary is
+	dumped at the end of the run.
+	checkpoint: optional checkpoint file. The loop state is saved there every
+	'every' ticks, and the file is removed once the run completes. If the file
+	exists the run resumes from it, appending to the existing output instead of
+	starting over. The checkpoint has to come from a run with the same file,
+	resolution, outfile and starting balances, otherwise ValueError is raised.
+	Needs a recorder with flush() and position, like recorder.Batch. A relative
+	path is taken from the data directory, like 'file'.
+	summary: also return the recorder's recorder.Summary, as (value, summary). A
+	resumed run's summary covers the whole run, the statistics are checkpointed too.
+	'''
 	timer = utils.Timer()
 
-	data 	= get_data(file)
-	model 	= ARIMA()
-	regionbank	= accounts.Account(start_regional, region)
-	wowbank	= accounts.Account(start_gold, "WoW")
-	records	= recorder.Batch(fn=outfile, dirpath="data")
-
-	dcs = evaluator.Decision(p0=0,
-							p1=0,
-							pred=0,
-							tradetype="hold",
-							tprice=0,
-							volume=0)
-
-	for i, row in enumerate(data):
-
-		time = row[0]
-		price = float(row[1])
-		timer.start()
-		# Trading script begins here
-		pred = model.next(price)
-
-		# Need to load the model with initial values
-		if i < 5:
-			timer.stop()
-			dcs = evaluator.Decision(p0=price,
-									p1=price,
-									pred=pred,
-									tradetype="hold",
-									tprice=price,
-									volume=0)
-			continue
-
-		dcs = evaluator.evaluate(mp=price,
-								prediction=price+pred,
-								regionbank=regionbank,
-								prior_dcs=dcs,
-								token=token)
-
-		# 'taper' will count volume decreased during a sale when there isn't enough in the
-		# WoW account to sell at the suggested volume
-		taper = 0
-		if dcs.tradetype is "buy":
-			cost = token * dcs.volume
-			gain = dcs.trade_price * dcs.volume
-
-			regionbank.withdraw(cost)
-			wowbank.deposit(gain)
-			
-		elif dcs.tradetype is "sell":
-			cost = dcs.trade_price * dcs.volume
-			gain = token * dcs.volume
-
-			try:
-				regionbank.deposit(gain)
-				wowbank.withdraw(cost)
-			except RuntimeError:
-				while cost > wowbank.value:
-					taper += 1
-					dcs.volume -= 1
-					dcs.trade_price = evaluator.Opt.sell_price(price, dcs.volume)
-					cost = dcs.trade_price * dcs.volume
-					regionbank.withdraw(token)
-				wowbank.withdraw(cost)
-
-
-			# Move profits to regional
-			if wowbank.value > price:
-				q = int(wowbank.value/price) - 1
-				regionbank.deposit(token*q)
-				wowbank.withdraw(q*price)
-
-
-		records.record(time=time,
-					regionbank=regionbank,
-					wowbank=wowbank,
-					taper=taper,
-					dcs=dcs,
-					runtime=timer.stop())
-
-		#print(dcs.tradetype, dcs.price)
-	print(regionbank.value + evaluator.gold_to_regional(wowbank.value, price/token))
+	# Work from the data directory, as get_data does
+	utils.os.chdir(utils.PathResolver().search(file))
+	run = {"file": file,
+			"resolution": resolution,
+			"outfile": outfile,
+			"region": region,
+			"start_regional": start_regional,
+			"start_gold": start_gold,
+			"token": token}
+	state	= None
+	if checkpoint is not None and os.path.exists(checkpoint):
+		state = ckpt.load(checkpoint)
+		ckpt.match(state, run)
+
+	if state is None:
+		start = 0
+		model 	= ARIMA()
+		regionbank	= accounts.Account(start_regional, region)
+		wowbank	= accounts.Account(start_gold, "WoW")
+		if records is None:
+			records	= recorder.Batch(fn=outfile, dirpath="data", mode=mode, token=token)
+
+		dcs = evaluator.Decision(p0=0,
+								p1=0,
+								pred=0,
+								tradetype="hold",
+								tprice=0,
+								volume=0)
+	else:
+		# Pick up after the last row the checkpoint covers
+		start = state["row"]
+		model, regionbank, wowbank, dcs = ckpt.restore(state)
+		# Recorder statistics go on from the rows before the checkpoint, so they need
+		# to be in it
+		keeps_stats = records is None or getattr(records, "stats", None) is not None
+		if keeps_stats and state.get("stats") is None:
+			raise ValueError("Checkpoint has no recorder statistics to resume")
+		if records is None:
+			records	= recorder.Batch(fn=outfile, dirpath="data", mode=state["mode"], position=state["position"],
+									token=token)
+		if keeps_stats:
+			records.stats.set_state(state["stats"])
+
+	try:
+		data 	= get_data(file, resolution, start)
+
+		# Decisions alternate between two objects, the current and the prior one
+		spare = evaluator.Decision(p0=0,
+								p1=0,
+								pred=0,
+								tradetype="hold",
+								tprice=0,
+								volume=0)
+
+		price = dcs.price
+		i = start - 1
+		for i, row in enumerate(data, start):
+			if checkpoint is not None and i > start and i % every == 0:
+				ckpt.save(checkpoint, ckpt.capture(model, regionbank, wowbank, dcs, i, records, run))
+
+			time = row[0]
+			price = float(row[1])
+			timer.start()
+			if profiler is not None:
+				t = profiler.clock()
+			# Trading script begins here
+			pred = model.next(price)
+			if profiler is not None:
+				t = profiler.lap("predict", t)
+
+			# Need to load the model with initial values
+			if i < 5:
+				timer.stop()
+				if profiler is not None:
+					profiler.count("warmup")
+				dcs.set(p0=price,
+						p1=price,
+						pred=pred,
+						tradetype="hold",
+						tprice=price,
+						volume=0)
+				continue
+
+			dcs, spare = evaluator.evaluate(mp=price,
+											prediction=price+pred,
+											regionbank=regionbank,
+											prior_dcs=dcs,
+											token=token,
+											profiler=profiler,
+											out=spare), dcs
+			if profiler is not None:
+				t = profiler.lap("evaluate", t)
+
+			taper = settle(dcs, price, token, regionbank, wowbank)
+			if profiler is not None:
+				t = profiler.lap("settle", t)
+				profiler.count(dcs.tradetype)
+				profiler.count("taper", taper)
+
+			records.record(time=time,
+						regionbank=regionbank,
+						wowbank=wowbank,
+						taper=taper,
+						dcs=dcs,
+						runtime=timer.stop())
+			if profiler is not None:
+				profiler.lap("record", t)
+
+			#print(dcs.tradetype, dcs.price)
+	finally:
+		# Stop the recorder's writer even if the run fails, so nothing is still being
+		# written when a resume cuts the output back to the checkpoint
+		records.close()
+	# The run is complete, nothing is left to resume
+	if checkpoint is not None and os.path.exists(checkpoint):
+		os.remove(checkpoint)
+	value = regionbank.value + evaluator.gold_to_regional(wowbank.value, price/token)
+	print(value)
+	if profiler is not None:
+		profiler.dump()
+	if summary:
+		return value, records.summary()
+	return value
 
 
 if __name__ == '__main__':
@@ -0,0 +1,281 @@
+'''
+Benchmarks for the trading hot path.
+
+Every benchmark runs on fixed synthetic inputs (seeded), at each of several series
+lengths, and reports the time per call and calls (ticks) per second. The best of
+'repeat' runs is kept. Results are saved as JSON so runs from different versions can
+be compared with compare().
+
+	python benchmark.py [--lengths 1000 10000 50000] [--repeat 3] [--out results.json]
+	python benchmark.py --compare old.json new.json
+'''
+
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time as _time
+import numpy as np
+import pandas as pd
+import accounts
+import algo
+import engine
+import evaluator
+import kernel
+import recorder
+import settlement
+import utils
+from model import ARIMA
+
+
+LENGTHS = (1000, 10000, 50000)
+
+
+def synthetic_prices(n, seed=0):
+	# Random walk around a token price of 150k gold
+	rng = np.random.default_rng(seed)
+	return np.round(150000 + np.cumsum(rng.normal(0, 800, n)))
+
+
+def synthetic_file(dirpath, n, seed=0):
+	price = synthetic_prices(n + 1, seed=seed).astype(np.int64)
+	time = pd.date_range("2018-01-01", periods=n + 1, freq="20min")
+	fn = f"bench-{n}-token-full.csv"
+	pd.DataFrame({"time": time, "price": price}).to_csv(os.path.join(dirpath, fn), index=False)
+	return fn
+
+
+def _best(fn, repeat):
+	best = None
+	for i in range(repeat):
+		start = _time.perf_counter()
+		fn()
+		elapsed = _time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+
+def _result(name, n, calls, seconds):
+	return {"name": name,
+			"n": n,
+			"calls": calls,
+			"seconds": seconds,
+			"per_call": seconds / calls,
+			"per_second": calls / seconds}
+
+
+def bench_model(n, repeat):
+	price = synthetic_prices(n).tolist()
+
+	def next_():
+		model = ARIMA()
+		for p in price:
+			model.next(p)
+
+	series = np.array(price)
+	return [_result("ARIMA.next", n, n, _best(next_, repeat)),
+			_result("ARIMA.filter", n, n, _best(lambda: ARIMA().filter(series), repeat))]
+
+
+def _buy_inputs(n):
+	rng = np.random.default_rng(1)
+	p1 = synthetic_prices(n)
+	p0 = p1 - np.abs(rng.normal(2000, 3000, n))
+	xb = rng.uniform(1, 500, n)
+	return p0, p1, xb
+
+
+def bench_optimizer(n, repeat):
+	# bisect is slow enough that a sample of calls gives a stable per call time
+	calls = min(n, 2000)
+	p0, p1, xb = _buy_inputs(n)
+	args = list(zip(p0[:calls].tolist(), p1[:calls].tolist(), xb[:calls].tolist()))
+
+	def bisect():
+		for a, b, c in args:
+			evaluator.Opt.bisect(p0=a, p1=b, xb=c)
+
+	return [_result("Opt.bisect", n, calls, _best(bisect, repeat)),
+			_result("Opt.solve", n, n, _best(lambda: evaluator.Opt.solve(p0, p1, xb), repeat))]
+
+
+def bench_evaluate(n, repeat):
+	price = synthetic_prices(n)
+	pred = ARIMA().filter(price)
+	rows = list(zip(price.tolist(), (price + pred).tolist()))
+
+	def evaluate():
+		regionbank = accounts.Account(1000, "EU")
+		dcs = evaluator.Decision(p0=rows[0][0], p1=rows[0][0], pred=0, tradetype="hold", tprice=rows[0][0])
+		for mp, prediction in rows:
+			dcs = evaluator.evaluate(mp=mp, prediction=prediction, regionbank=regionbank, prior_dcs=dcs, token=20)
+
+	return [_result("evaluate", n, n, _best(evaluate, repeat))]
+
+
+def bench_taper(n, repeat):
+	# Sells of 50 units where the WoW account only covers about half of them
+	calls = min(n, 2000)
+	price = synthetic_prices(calls).tolist()
+
+	def taper():
+		for mp in price:
+			dcs = evaluator.Decision(p0=mp, p1=mp, pred=mp, tradetype="sell",
+									tprice=evaluator.Opt.sell_price(mp, 50), volume=50)
+			settlement.settle(dcs, mp, 20, accounts.Account(0, "EU"), accounts.Account(25*mp, "WoW"))
+
+	return [_result("settle.taper", n, calls, _best(taper, repeat))]
+
+
+def bench_recorder(n, repeat, dirpath):
+	price = synthetic_prices(n).tolist()
+	time = pd.date_range("2018-01-01", periods=n, freq="20min").astype(str).tolist()
+	regionbank = accounts.Account(1000, "EU")
+	wowbank = accounts.Account(200000, "WoW")
+	dcs = [evaluator.Decision(p0=p, p1=p, pred=p, tradetype="hold", tprice=p) for p in price]
+
+	results = []
+	for mode in ("csv", "npy"):
+		def record():
+			records = recorder.Batch(fn=f"bench.{mode}", dirpath=dirpath, mode=mode)
+			for t, d in zip(time, dcs):
+				records.record(time=t, regionbank=regionbank, wowbank=wowbank, dcs=d, taper=0, runtime=0.0)
+			records.close()
+
+		results.append(_result(f"Batch.record[{mode}]", n, n, _best(record, repeat)))
+	return results
+
+
+def bench_get_data(n, repeat, dirpath):
+	fn = synthetic_file(dirpath, n)
+
+	def get_data():
+		for row in algo.get_data(fn):
+			pass
+
+	return [_result("get_data", n, n, _best(get_data, repeat)),
+			_result("get_series", n, n, _best(lambda: algo.get_series(fn), repeat))]
+
+
+def bench_backtest(n, repeat, dirpath):
+	fn = synthetic_file(dirpath, n)
+
+	def loop():
+		with utils.suppress_stdout():
+			algo.algo(file=fn, start_regional=1000, region="EU", start_gold=200000, token=20, outfile="bench-run.txt")
+
+	time, price = algo.get_series(fn)
+	# Compile the kernel first, so its timing is of the compiled loop
+	kernel.backtest(price[:100], 1000, 200000, 20)
+	return [_result("algo.algo", n, n, _best(loop, repeat)),
+			_result("engine.backtest", n, n, _best(lambda: engine.backtest(price, 1000, 200000, 20), repeat)),
+			_result("kernel.backtest", n, n, _best(lambda: kernel.backtest(price, 1000, 200000, 20), repeat))]
+
+
+def bench_paths(repeat, dirpath):
+	# A target five levels down in a tree with a few hundred directories
+	root = os.path.join(dirpath, "tree")
+	for a in range(6):
+		for b in range(6):
+			for c in range(6):
+				os.makedirs(os.path.join(root, f"a{a}", f"b{b}", f"c{c}"), exist_ok=True)
+	leaf = os.path.join(root, "a5", "b5", "c5", "d", "e")
+	os.makedirs(leaf, exist_ok=True)
+	open(os.path.join(leaf, "target.csv"), "w").close()
+
+	def resolver():
+		# A fresh key each time so the memo doesn't answer
+		utils._resolved.clear()
+		utils.PathResolver().search("target.csv", start=root)
+
+	return [_result("PathFinder.search", 0, 1, _best(lambda: utils.PathFinder().search("target.csv", start=root), repeat)),
+			_result("PathResolver.search", 0, 1, _best(resolver, repeat))]
+
+
+def _meta():
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+								cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except OSError:
+		commit = ""
+	return {"commit": commit,
+			"created": _time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"pandas": pd.__version__,
+			"machine": platform.machine(),
+			"processor": platform.processor()}
+
+
+def run(lengths=LENGTHS, repeat=3, out=None):
+	'''
+	Run every benchmark at each length. Returns the results as a dict and writes it
+	to 'out' as JSON if given.
+	'''
+	cwd = os.getcwd()
+	results = []
+	with tempfile.TemporaryDirectory() as tmp:
+		data = os.path.join(tmp, "data")
+		os.makedirs(data)
+		try:
+			os.chdir(tmp)
+			results.extend(bench_paths(repeat, tmp))
+			for n in lengths:
+				results.extend(bench_model(n, repeat))
+				results.extend(bench_optimizer(n, repeat))
+				results.extend(bench_evaluate(n, repeat))
+				results.extend(bench_taper(n, repeat))
+				results.extend(bench_recorder(n, repeat, data))
+				results.extend(bench_get_data(n, repeat, data))
+				results.extend(bench_backtest(n, repeat, data))
+				os.chdir(tmp)
+		finally:
+			os.chdir(cwd)
+
+	report = {"meta": _meta(), "results": results}
+	if out is not None:
+		with open(out, "w") as f:
+			json.dump(report, f, indent=1)
+	return report
+
+
+def table(report):
+	df = pd.DataFrame(report["results"])
+	return df[["name", "n", "calls", "per_call", "per_second"]]
+
+
+def compare(old, new, threshold=0.1):
+	'''
+	old, new: saved result files. Returns every benchmark found in both with the
+	ratio of new to old time per call. Rows slower by more than 'threshold' are
+	flagged as regressions.
+	'''
+	frames = []
+	for fp in (old, new):
+		with open(fp, "r") as f:
+			frames.append(pd.DataFrame(json.load(f)["results"]).set_index(["name", "n"])["per_call"])
+
+	df = pd.concat(frames, axis=1, keys=["old", "new"], join="inner")
+	df["ratio"] = df["new"] / df["old"]
+	df["regression"] = df["ratio"] > 1 + threshold
+	return df
+
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--lengths", type=int, nargs="+", default=list(LENGTHS))
+	parser.add_argument("--repeat", type=int, default=3)
+	parser.add_argument("--out", default=None)
+	parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None)
+	args = parser.parse_args()
+
+	pd.set_option("display.width", 200)
+	if args.compare:
+		print(compare(*args.compare).to_string())
+	else:
+		out = args.out or f"benchmark-{_time.strftime('%Y%m%d-%H%M%S')}.json"
+		print(table(run(args.lengths, args.repeat, out)).to_string(index=False))
+		print(f"Saved to {out}")
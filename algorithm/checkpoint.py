@@ -0,0 +1,86 @@
+'''
+Checkpoints of a running algo.algo.
+
+A checkpoint holds everything the trading loop carries from one tick to the next:
+	- the ARIMA coefficients and state (ARIMA.get_state)
+	- both account balances
+	- the prior Decision
+	- the number of input rows consumed
+	- the recorder's output size, taken right after a flush, so it always falls on
+	  a row boundary
+	- the recorder's running statistics (recorder.Stats), if it keeps them
+	- the parameters of the run (file, resolution, output, starting balances), so a
+	  checkpoint is never resumed into a different run
+
+Resuming loads the state, skips the consumed rows and reopens the recorder output at
+the saved size (recorder.Batch(position=...)). Rows written after the checkpoint
+are cut off and written again, so the output ends up the same as an uninterrupted
+run's. A run that completes removes its checkpoint.
+
+Checkpoints are small JSON files. Floats are written with repr, which reads back
+to the same value. Each save goes to a temporary file that then replaces the last
+checkpoint, so a crash while saving leaves the previous one intact.
+'''
+
+import json
+import os
+import accounts
+import evaluator
+from model import ARIMA
+
+
+def capture(model, regionbank, wowbank, dcs, row, records, run):
+	'''
+	State of the loop after 'row' input rows. Flushes 'records'. 'run' is a dict
+	of the run's parameters, checked by match() on resume.
+	'''
+	records.flush()
+	stats = getattr(records, "stats", None)
+	return {"run": run,
+			"model": model.get_state(),
+			"regionbank": [regionbank.value, regionbank.name],
+			"wowbank": [wowbank.value, wowbank.name],
+			"decision": [dcs.price, dcs.price_lag1, dcs.prediction, dcs.code, dcs.trade_price, dcs.volume],
+			"row": row,
+			"position": records.position,
+			"mode": records.mode,
+			"stats": None if stats is None else stats.get_state()}
+
+
+def save(fp, state):
+	tmp = f"{fp}.tmp"
+	with open(tmp, "w") as f:
+		json.dump(state, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, fp)
+
+
+def load(fp):
+	with open(fp, "r") as f:
+		return json.load(f)
+
+
+def match(state, run):
+	'''
+	Raises ValueError if 'state' was captured by a run with other parameters
+	'''
+	saved = state.get("run", {})
+	# Compared after a JSON round trip, the way the saved values were stored
+	run = json.loads(json.dumps(run))
+	diff = [name for name in sorted(set(saved) | set(run)) if saved.get(name) != run.get(name)]
+	if diff:
+		changes = ", ".join(f"{name}: {saved.get(name)!r} -> {run.get(name)!r}" for name in diff)
+		raise ValueError(f"Checkpoint is from a different run ({changes})")
+
+
+def restore(state):
+	'''
+	Returns (model, regionbank, wowbank, dcs) as they were when 'state' was captured
+	'''
+	model = ARIMA(state["model"]["ar_params"], state["model"]["ma_params"])
+	model.set_state(state["model"])
+	regionbank = accounts.Account(*state["regionbank"])
+	wowbank = accounts.Account(*state["wowbank"])
+	dcs = evaluator.Decision(*state["decision"])
+	return model, regionbank, wowbank, dcs
@@ -0,0 +1,255 @@
+'''
+Whole-series backtest engine.
+
+Runs the same strategy as algo.algo, but over the full price series at once instead of
+one row at a time. Everything that does not depend on account balances is computed
+as arrays up front:
+	- model predictions for every tick
+	- buy signals (market price above the prediction)
+	- trade types. A buy is always unwound by a sell on the next tick, so the
+	  hold/buy/sell sequence is fixed by the signals alone
+
+Only the ticks that actually trade touch the balances, so the sequential part of the
+run is a plain float loop over those ticks. Hold ticks carry the balances forward.
+
+Results come back as a DataFrame with the same columns recorder.Batch writes (minus
+runtime), one row per evaluated tick.
+'''
+
+import numpy as np
+import pandas as pd
+import evaluator
+import settlement
+from evaluator import HOLD, BUY, SELL, TRADETYPES
+from model import ARIMA
+
+# Ticks used to load the model before any trading decisions are made
+WARMUP = 5
+
+
+def predict_series(price, model=None):
+	'''
+	One-step predictions of the price change for every tick in the series
+	'''
+	if model is None:
+		model = ARIMA()
+	return model.filter(price)
+
+
+def trade_types(signal, prior=HOLD):
+	'''
+	signal: boolean array, True where the strategy wants to buy
+	prior: trade type of the decision before the first tick
+
+	Within a run of consecutive buy signals the trades alternate buy, sell, buy, ...
+	starting at the first tick of the run. The tick after every buy is a sell.
+	'''
+	n = len(signal)
+	if prior == BUY and n:
+		# The first tick sells the prior buy
+		signal = signal.copy()
+		signal[0] = False
+
+	idx = np.arange(n)
+	starts = signal & ~np.concatenate(([False], signal[:-1]))
+	runstart = np.maximum.accumulate(np.where(starts, idx, 0))
+
+	buy = signal & ((idx - runstart) % 2 == 0)
+	sell = np.concatenate(([prior == BUY], buy[:-1]))
+
+	types = np.full(n, HOLD, dtype=np.int8)
+	types[buy] = BUY
+	types[sell] = SELL
+	return types
+
+
+def _carry_forward(values, traded, start):
+	# Fill the balance of every non-trading tick with the last traded balance
+	idx = np.arange(len(values))
+	last = np.maximum.accumulate(np.where(traded, idx, -1))
+	return np.where(last < 0, start, values[np.maximum(last, 0)])
+
+
+def simulate(price, prediction, start_regional, start_gold, token, prior_dcs=None, warmup=0, time=None,
+			signal=None):
+	'''
+	Trade a stretch of prices given the model's predictions (price + predicted change).
+
+	prior_dcs: the decision made on the tick before 'price' starts, e.g. the last
+		decision of an earlier stretch. A prior buy is sold on the first tick.
+	warmup: number of leading ticks that only hold
+	signal: optional boolean array of the ticks to buy on, in place of the market
+		price being above the prediction (see evaluator.Strategy.signal)
+
+	Returns a DataFrame with a row for every tick and the state at the end as
+	(regionbank, wowbank, last Decision), ready to be passed to the next stretch.
+	'''
+	price = np.asarray(price, dtype=float)
+	prediction = np.asarray(prediction, dtype=float)
+	n = len(price)
+	prior = HOLD if prior_dcs is None else prior_dcs.code
+
+	if signal is None:
+		signal = price > prediction
+	else:
+		signal = np.array(signal, dtype=bool)
+	signal[:warmup] = False
+	types = trade_types(signal, prior=prior)
+
+	trade_price = price.copy()
+	volume = np.zeros(n, dtype=np.int64)
+	taper = np.zeros(n, dtype=np.int64)
+	regional = np.empty(n)
+	gold = np.empty(n)
+
+	regionbank = start_regional
+	wowbank = start_gold
+	mps = price.tolist()
+	predictions = prediction.tolist()
+	v = prior_dcs.volume if prior == BUY else 0
+
+	traded = types != HOLD
+	for i in np.flatnonzero(traded).tolist():
+		mp = mps[i]
+
+		if types[i] == BUY:
+			v = evaluator.Opt.bisect(p0=predictions[i], p1=mp, xb=regionbank/token)
+			tprice = evaluator.Opt.buy_price(mp=mp, v=v)
+			regionbank, wowbank = settlement.buy(v, tprice, token, regionbank, wowbank)
+
+		else:
+			# Sell the volume bought on the previous tick
+			tprice = evaluator.Opt.sell_price(mp=mp, v=v)
+			regionbank, wowbank, v, tprice, taper[i] = settlement.sell(mp, v, tprice, token, regionbank, wowbank)
+			regionbank, wowbank = settlement.sweep(mp, token, regionbank, wowbank)
+
+		trade_price[i] = tprice
+		volume[i] = v
+		regional[i] = regionbank
+		gold[i] = wowbank
+
+	regional = _carry_forward(regional, traded, start_regional)
+	gold = _carry_forward(gold, traded, start_gold)
+
+	first = np.nan if prior_dcs is None else prior_dcs.price
+	prior_price = np.concatenate(([first], price[:-1]))
+	out = pd.DataFrame({"market_price": price,
+						"prior_price": prior_price,
+						"prediction": prediction,
+						"trade": pd.Categorical.from_codes(types, TRADETYPES),
+						"tradeprice": trade_price,
+						"volume": volume,
+						"regionbank": regional,
+						"wowbank": gold,
+						"taper": taper},
+						index=time)
+
+	last = prior_dcs
+	if n:
+		last = evaluator.Decision(p0=mps[-1],
+								p1=prior_price[-1],
+								pred=predictions[-1],
+								tradetype=int(types[-1]),
+								tprice=trade_price[-1],
+								volume=int(volume[-1]))
+	return out, (regionbank, wowbank, last)
+
+
+def backtest(price, start_regional, start_gold, token, time=None, model=None):
+	'''
+	price: 1-D array of market prices (gold per token)
+	time: optional array of timestamps used as the result index
+
+	Returns a DataFrame of decisions and balances for every tick after the warm-up.
+	'''
+	price = np.asarray(price, dtype=float)
+	pred = predict_series(price, model=model)
+	out = simulate(price, price + pred, start_regional, start_gold, token, warmup=WARMUP, time=time)[0]
+	return out.iloc[WARMUP:]
+
+
+def run_strategies(blocks, strategies, model=None, warmup=WARMUP):
+	'''
+	Run many evaluator.Strategy objects over one pass of the data.
+
+	blocks: iterable of (time, price, ...) arrays, e.g. algo.read_blocks(file)
+	model: ARIMA whose predictions every strategy shares, a fresh one by default
+
+	Each block is predicted once. Strategies with a vectorized form (signal()) trade
+	the block with simulate(); the others decide and settle tick by tick. The
+	first 'warmup' ticks only hold, like algo.algo's.
+
+	Returns a DataFrame with the final value and trade counts of each strategy.
+	'''
+	if model is None:
+		model = ARIMA()
+	names = [s.name for s in strategies]
+	if len(set(names)) != len(names):
+		raise ValueError("Strategy names must be unique")
+
+	counts = {s.name: {"buys": 0, "sells": 0, "volume": 0, "taper": 0} for s in strategies}
+	seen = 0
+	for block in blocks:
+		price = np.asarray(block[1], dtype=float)
+		prediction = price + model.filter(price)
+		hold = max(0, min(warmup - seen, len(price)))
+		seen += len(price)
+
+		for strategy in strategies:
+			c = counts[strategy.name]
+			signal = strategy.signal(price, prediction)
+			if signal is not None:
+				out, (regional, gold, last) = simulate(price, prediction, strategy.regionbank.value,
+													strategy.wowbank.value, strategy.token,
+													prior_dcs=strategy.dcs, warmup=hold, signal=signal)
+				strategy.regionbank.value = regional
+				strategy.wowbank.value = gold
+				strategy.dcs = last
+				codes = out["trade"].cat.codes.to_numpy()
+				c["buys"] += int((codes == BUY).sum())
+				c["sells"] += int((codes == SELL).sum())
+				c["volume"] += int(out["volume"].to_numpy()[codes == BUY].sum())
+				c["taper"] += int(out["taper"].sum())
+				continue
+
+			for i, (mp, pred) in enumerate(zip(price.tolist(), prediction.tolist())):
+				if i < hold:
+					strategy.dcs.set(mp, mp, pred, HOLD, mp, 0)
+					continue
+				dcs = strategy.decide(mp, pred)
+				strategy.spare, strategy.dcs = strategy.dcs, dcs
+				taper = settlement.settle(dcs, mp, strategy.token, strategy.regionbank, strategy.wowbank)
+				if dcs.code == BUY:
+					c["buys"] += 1
+					c["volume"] += dcs.volume
+				elif dcs.code == SELL:
+					c["sells"] += 1
+					c["taper"] += taper
+
+	rows = []
+	for strategy in strategies:
+		rows.append(dict(strategy=strategy.name, final_value=strategy.value, **counts[strategy.name]))
+	return pd.DataFrame(rows).set_index("strategy")
+
+
+def final_value(result, token):
+	'''
+	Value of both accounts in regional currency at the last price of the run
+	'''
+	last = result.iloc[-1]
+	return last.regionbank + evaluator.gold_to_regional(last.wowbank, last.market_price/token)
+
+
+def run(file, start_regional, start_gold, token):
+	import algo
+	time, price = algo.get_series(file)
+	result = backtest(price, start_regional, start_gold, token, time=time)
+	print(final_value(result, token))
+	return result
+
+
+if __name__ == '__main__':
+	run(file="eu-token-full.csv",
+		start_regional=1000,
+		start_gold=200000,
+		token=20)
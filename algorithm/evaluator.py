@@ -39,7 +39,10 @@ dpi/dq = (mp_1 * (1-r)^q + q * mp_1 * (1-r)^q * ln(1-r)) - (mp_0 * (1+r)^q + mp_
 -> dpi/dq = mp_1*(1-r)^q * (1 + q*ln(1-r)) - mp_0*(1+r)^q * (1 + q*ln(1+r))
 '''
 
+from enum import IntEnum
 from math import log
+import numpy as np
+import accounts
 from model import ARIMA
 
 
@@ -110,27 +113,154 @@ class Opt:
 
 		return int(xc)
 
+	@classmethod
+	def solve(cls, p0, p1, xb, tolerr=tolerr, maxiter=maxiter):
+		'''
+		Vectorized replacement for bisect. p0, p1 and xb are arrays (or scalars) and the
+		result is an array of integer volumes, one per (p0, p1, xb) triple.
+
+		With a = ln(1-cr) and b = ln(1+cr) computed once, dpi/dq from the module
+		docstring is
+			f(q) = p1*e^(aq)*(1+aq) - p0*e^(bq)*(1+bq)
+			f'(q) = p1*e^(aq)*a*(2+aq) - p0*e^(bq)*b*(2+bq)
+		f is decreasing for q < 2/cr, so a safeguarded Newton iteration started from the
+		first order root (p1-p0)/(2(p0*b - p1*a)) finds the root q* inside [0, xb].
+
+		bisect stops on a relative tolerance and truncates its last midpoint, so the
+		root alone doesn't say which integer it returns. Knowing q*, every comparison
+		bisect makes is just "midpoint > q*", so its midpoints are replayed with plain
+		arithmetic to land on the same integer. Ceilings at or above 2/cr fall back to
+		the scalar bisect.
+		'''
+		p0, p1, xb = np.broadcast_arrays(np.asarray(p0, dtype=float),
+										np.asarray(p1, dtype=float),
+										np.asarray(xb, dtype=float))
+		shape = p0.shape
+		p0, p1, xb = p0.ravel(), p1.ravel(), xb.ravel()
+		a = log(1-cls.cr)
+		b = log(1+cls.cr)
+
+		# Bisection only moves its ceiling when the derivative at the midpoint has the
+		# opposite sign of the derivative at the floor. With f(0) = p1 - p0 <= 0 or no
+		# sign change before xb it never does, which is the same as a root at infinity.
+		root = np.full(len(p0), np.inf)
+		fb = p1*np.exp(a*xb)*(1+a*xb) - p0*np.exp(b*xb)*(1+b*xb)
+		bracket = (p1 > p0) & (fb < 0)
+
+		if bracket.any():
+			idx = np.flatnonzero(bracket)
+			q0, q1, lo, hi = p0[idx], p1[idx], np.zeros(len(idx)), xb[idx]
+			x = np.clip((q1 - q0) / (2*(q0*b - q1*a)), lo, hi)
+			last = np.full(len(idx), np.inf)
+			for i in range(maxiter):
+				ea = q1*np.exp(a*x)
+				eb = q0*np.exp(b*x)
+				fx = ea*(1+a*x) - eb*(1+b*x)
+				dfx = ea*a*(2+a*x) - eb*b*(2+b*x)
+
+				lo = np.where(fx > 0, x, lo)
+				hi = np.where(fx < 0, x, hi)
+				step = np.abs(fx / dfx)
+				xn = x - fx / dfx
+				# Keep Newton inside the bracket, bisect the bracket when it steps out
+				outside = ~((xn > lo) & (xn < hi))
+				xn[outside] = 0.5*(lo[outside] + hi[outside])
+				x = xn
+
+				# A root is done when its step is within tolerance, or is small and no
+				# longer shrinking, i.e. down to rounding noise in f. Done roots
+				# leave the iteration.
+				scale = np.maximum(x, 1)
+				done = (step <= 1e-12*scale) | ((step >= last) & (step <= 1e-8*scale))
+				if done.any():
+					root[idx[done]] = x[done]
+					keep = ~done
+					idx, q0, q1, lo, hi, x, step = idx[keep], q0[keep], q1[keep], lo[keep], hi[keep], x[keep], step[keep]
+					if not len(idx):
+						break
+				last = step
+			root[idx] = x
+
+		# Replay bisect's midpoints, dropping each volume once bisect would stop
+		xc = np.zeros(len(p0))
+		idx = np.flatnonzero(xb >= tolerr)
+		xa, xhi, r = np.zeros(len(idx)), xb[idx], root[idx]
+		xc_old = 0.75*(xa + xhi)
+		for i in range(maxiter + 1):
+			if not len(idx):
+				break
+			c = 0.5*(xa + xhi)
+			down = c > r
+			xhi = np.where(down, c, xhi)
+			xa = np.where(down, xa, c)
+
+			done = np.abs((c - xc_old) / xc_old) < tolerr
+			xc_old = c
+			if done.any():
+				xc[idx[done]] = c[done]
+				keep = ~done
+				idx, xa, xhi, r, xc_old = idx[keep], xa[keep], xhi[keep], r[keep], xc_old[keep]
+		else:
+			xc[idx] = xc_old
+
+		volume = np.trunc(xc).astype(np.int64)
+
+		# Outside the range where f is monotonic
+		for i in np.flatnonzero(xb >= 2/cls.cr):
+			volume[i] = cls.bisect(p0=p0[i], p1=p1[i], xb=xb[i], tolerr=tolerr, maxiter=maxiter)
+
+		return volume.reshape(shape)
+
 	def __call__(cls, *args, **kwargs):
 		return cls.bisect(*args, **kwargs)
 
 
+class TradeType(IntEnum):
+	HOLD = 0
+	BUY = 1
+	SELL = 2
+
+# Trade types as small integer codes. TRADETYPES holds their names by code.
+HOLD, BUY, SELL = TradeType.HOLD, TradeType.BUY, TradeType.SELL
+TRADETYPES = ["hold", "buy", "sell"]
+TRADECODES = {name: code for code, name in enumerate(TRADETYPES)}
+
+
 class Decision:
+	# The trade type is kept as its integer code. 'tradetype' reads and sets it by name.
+	__slots__ = ("price", "price_lag1", "prediction", "code", "trade_price", "volume")
+
 	def __init__(self, p0, p1, pred, tradetype, tprice, volume=0):
+		self.set(p0, p1, pred, tradetype, tprice, volume)
+
+	def set(self, p0, p1, pred, tradetype, tprice, volume=0):
 		self.price = p0
 		self.price_lag1 = p1
 		self.prediction = pred
 		self.tradetype = tradetype
 		self.trade_price = tprice
 		self.volume = volume
+		return self
+
+	@property
+	def tradetype(self):
+		return TRADETYPES[self.code]
+
+	@tradetype.setter
+	def tradetype(self, tradetype):
+		self.code = TRADECODES[tradetype] if isinstance(tradetype, str) else int(tradetype)
 
 	@property
 	def array(self):
 		return [self.price, self.price_lag1, self.prediction, self.tradetype, self.trade_price, self.volume]
 
 
-def evaluate(mp, prediction, regionbank, prior_dcs, token):
+def evaluate(mp, prediction, regionbank, prior_dcs, token, profiler=None, out=None):
 	'''
 	marketprice: Currency Object
+	profiler: optional profiler.Profiler, times the volume search as "optimize"
+	out: optional Decision to fill in instead of allocating a new one. A loop only
+		needs the current and prior decision, so it can alternate between two.
 	
 
 	Trading strategy is based on profit-optimized quantities, mean-reversion, and
@@ -147,33 +277,43 @@ def evaluate(mp, prediction, regionbank, prior_dcs, token):
 	4. Build decision object and return it
 	'''
 
+	prior_price = prior_dcs.price
+	prior_code = prior_dcs.code
+	prior_volume = prior_dcs.volume
+
 	# By prebuilding with the default to 'Hold', we must remember to update the
 	# tradetype, tprice, and volume attributes
-	dcs = Decision(p0=mp,
-					p1=prior_dcs.price,
-					pred=prediction,
-					tradetype="hold",
-					tprice=mp,
-					volume=0)
+	if out is None:
+		dcs = Decision(p0=mp,
+						p1=prior_price,
+						pred=prediction,
+						tradetype=HOLD,
+						tprice=mp,
+						volume=0)
+	else:
+		dcs = out.set(mp, prior_price, prediction, HOLD, mp, 0)
 
 	# Sell
-	if prior_dcs.tradetype == "buy":
+	if prior_code == BUY:
 		# Compute selling price
-		trade_price = Opt.sell_price(mp=mp, v=prior_dcs.volume)
+		trade_price = Opt.sell_price(mp=mp, v=prior_volume)
 
-		dcs.trade = True
-		dcs.tradetype = "sell"
+		dcs.code = SELL
 		dcs.trade_price = trade_price
-		dcs.volume = prior_dcs.volume
+		dcs.volume = prior_volume
 
 	else:
 		# The exchange rate (gold per 15 usd) is expected to decrease
 		# Buy
 		if mp > prediction:
+			if profiler is not None:
+				t = profiler.clock()
 			volume = Opt.bisect(p0=prediction, p1=mp, xb=regionbank.value/token)
+			if profiler is not None:
+				profiler.lap("optimize", t)
 			trade_price = Opt.buy_price(mp=mp, v=volume)
 
-			dcs.tradetype = "buy"
+			dcs.code = BUY
 			dcs.trade_price = trade_price
 			dcs.volume = volume
 		else:
@@ -182,4 +322,61 @@ def evaluate(mp, prediction, regionbank, prior_dcs, token):
 	return dcs
 
 
+class Strategy:
+	'''
+	A trading rule with its own accounts and decision state, so many strategies can
+	be run side by side over one data pass and one stream of model predictions
+	(engine.run_strategies).
+
+	decide() makes the decision for one tick from the market price, the model's
+	prediction and the prior decision (self.dcs). It can fill and return self.spare
+	instead of allocating; the runner settles the decision and swaps it into
+	self.dcs.
+
+	A strategy that trades like evaluate() (buy the optimal volume on a signal, sell
+	it on the next tick) can also override signal(), which marks the ticks it wants
+	to buy on for a whole block at once. The runner then trades the block with
+	engine.simulate instead of calling decide() per tick.
+	'''
+	def __init__(self, start_regional, start_gold, token, region="EU", name=None):
+		self.name = type(self).__name__ if name is None else name
+		self.token = token
+		self.regionbank = accounts.Account(start_regional, region)
+		self.wowbank = accounts.Account(start_gold, "WoW")
+		self.dcs = Decision(p0=0, p1=0, pred=0, tradetype=HOLD, tprice=0, volume=0)
+		self.spare = Decision(p0=0, p1=0, pred=0, tradetype=HOLD, tprice=0, volume=0)
+
+	def decide(self, mp, prediction):
+		raise NotImplementedError
+
+	def signal(self, price, prediction):
+		'''
+		Boolean array, True where the strategy wants to buy. None if the strategy has
+		no vectorized form.
+		'''
+		return None
+
+	@property
+	def value(self):
+		return self.regionbank.value + gold_to_regional(self.wowbank.value, self.dcs.price/self.token)
 
+
+class MeanReversion(Strategy):
+	'''
+	evaluate()'s rule: buy when the market price is more than 'threshold' above
+	the prediction, sell on the next tick. threshold=0 is evaluate() itself.
+	'''
+	def __init__(self, start_regional, start_gold, token, threshold=0, **kwargs):
+		super().__init__(start_regional, start_gold, token, **kwargs)
+		if threshold < 0:
+			raise ValueError("threshold can't be negative")
+		self.threshold = threshold
+
+	def decide(self, mp, prediction):
+		if self.dcs.code != BUY and not mp > prediction + self.threshold:
+			return self.spare.set(mp, self.dcs.price, prediction, HOLD, mp, 0)
+		return evaluate(mp=mp, prediction=prediction, regionbank=self.regionbank, prior_dcs=self.dcs,
+						token=self.token, out=self.spare)
+
+	def signal(self, price, prediction):
+		return price > prediction + self.threshold
@@ -0,0 +1,316 @@
+'''
+Fused tick loop.
+
+algo.algo runs every tick through ARIMA.next, evaluator.evaluate, Opt.bisect, the
+accounts and the recorder, each a Python call on Python objects. Here the same
+steps (predict, decide, size the buy, settle) are one function over plain arrays
+and floats, written so Numba can compile it. With Numba installed the loop is
+compiled to machine code on first use; without it the very same function runs as
+plain Python on lists, which is still free of the per tick calls and allocations.
+Setting KERNEL_CACHE=1 in the environment keeps the compiled code in __pycache__
+next to this module, so later processes skip the compile. It is off by default,
+since that directory may not be writable.
+
+Every step repeats the arithmetic of the code it stands in for, operation for
+operation:
+	- the model state is kept truncated to integers, newest first, and the AR and MA
+	  products are summed newest lag first, like ARIMA.predict
+	- buys are sized with Opt.bisect's iteration, not Opt.solve's
+	- prices are compounded with a float exponent, which is what Python's ** does
+	  with the integer volumes
+	- sales the WoW account can't cover are tapered like settlement.sell
+so the decisions and balances are the same, bit for bit, as algo.algo's.
+
+The output has the columns of engine.simulate.
+'''
+
+import os
+import types
+from math import log
+import numpy as np
+import pandas as pd
+import engine
+import evaluator
+from evaluator import HOLD, TRADETYPES
+from model import ARIMA
+
+try:
+	from numba import njit
+except ImportError:
+	njit = None
+
+# True when the loop is compiled with Numba
+JIT = njit is not None
+
+# Cache compiled code on disk, opt-in
+CACHE = os.environ.get("KERNEL_CACHE", "") == "1"
+
+_compiled = None
+
+
+def _derivative(p0, p1, v, cr, a, b):
+	# Opt.profit_derivative
+	return p1*(1 - cr)**v * (1 + a*v) - p0*(1 + cr)**v * (1 + b*v)
+
+
+def _bisect(p0, p1, xb, cr, a, b, tolerr, maxiter):
+	# Opt.bisect with xa = 0
+	xa = 0.0
+	i = 0
+	abserr = xb - xa
+	xc_old = 0.75*(xa + xb)
+	if abserr < tolerr:
+		# Opt.bisect has no midpoint to return either
+		raise RuntimeError("No volume to search, the regional account is empty")
+	xc = 0.0
+	while abserr >= tolerr and i <= maxiter:
+		xc = 0.5*(xa + xb)
+		fafc = _derivative(p0, p1, xa, cr, a, b) * _derivative(p0, p1, xc, cr, a, b)
+		if fafc < 0:
+			xb = xc
+		else:
+			xa = xc
+		abserr = abs((xc - xc_old)/xc_old)
+		i += 1
+		xc_old = xc
+	return int(xc)
+
+
+def _cost(price, v, cr):
+	return price*(1 + cr)**float(v) * v
+
+
+def _affordable(price, volume, gold, cr, b):
+	# settlement.affordable
+	if volume <= 0:
+		return 0
+
+	guess = 0
+	v = gold / price
+	if v > 1:
+		v -= (log(v) + v*b - log(gold/price)) / (1/v + b)
+		guess = int(v)
+	guess = min(max(guess, 0), volume - 1)
+
+	step = 1
+	if _cost(price, guess, cr) <= gold:
+		lo, hi = guess, min(guess + step, volume)
+		while hi < volume and _cost(price, hi, cr) <= gold:
+			lo, step = hi, step*2
+			hi = min(lo + step, volume)
+	else:
+		lo, hi = max(guess - step, 0), guess
+		while lo > 0 and _cost(price, lo, cr) > gold:
+			hi, step = lo, step*2
+			lo = max(hi - step, 0)
+
+	while hi - lo > 1:
+		mid = (lo + hi) // 2
+		if _cost(price, mid, cr) <= gold:
+			lo = mid
+		else:
+			hi = mid
+	return lo
+
+
+def _loop(price, ar_params, ma_params, ar_vals, ma_vals, prior_val, model_pred, regional, gold, code, v,
+			token, warmup, cr, tolerr, maxiter, prediction, codes, trade_price, volume, regionbank, wowbank, taper):
+	'''
+	Trade every tick of 'price'. The model state (ar_vals, ma_vals) is updated in
+	place and the per tick results are written to the output arrays from
+	'prediction' on. Returns the scalar state at the end.
+	'''
+	a = log(1 - cr)
+	b = log(1 + cr)
+	p = len(ar_params)
+	q = len(ma_params)
+
+	for i in range(len(price)):
+		mp = price[i]
+
+		# ARIMA.next
+		diff = mp - prior_val
+		error = diff - model_pred
+		for k in range(p - 1, 0, -1):
+			ar_vals[k] = ar_vals[k-1]
+		if p:
+			ar_vals[0] = float(int(diff))
+		for k in range(q - 1, 0, -1):
+			ma_vals[k] = ma_vals[k-1]
+		if q:
+			ma_vals[0] = float(int(error))
+		ar = 0.0
+		for k in range(p):
+			ar += ar_params[k]*ar_vals[k]
+		ma = 0.0
+		for k in range(q):
+			ma += ma_params[k]*ma_vals[k]
+		model_pred = ar + ma
+		prior_val = mp
+		pred = mp + model_pred
+		prediction[i] = pred
+
+		tprice = mp
+		t = 0
+		if i < warmup:
+			code = 0
+			v = 0
+
+		# evaluate and settle
+		elif code == 1:
+			code = 2
+			tprice = mp*(1 + cr)**float(v)
+			regional += token*v
+			cost = tprice*v
+			if cost > gold:
+				kept = _affordable(mp, v, gold, cr, b)
+				t = v - kept
+				v = kept
+				tprice = mp*(1 + cr)**float(v)
+				cost = tprice*v
+				regional -= token*t
+			gold = gold - cost
+			if gold > mp:
+				n = int(gold/mp) - 1
+				regional += token*n
+				gold -= n*mp
+
+		elif mp > pred:
+			code = 1
+			v = _bisect(pred, mp, regional/token, cr, a, b, tolerr, maxiter)
+			tprice = mp*(1 - cr)**float(v)
+			if token*v > regional:
+				raise RuntimeError("Tried to withdraw more than the regional account holds")
+			regional -= token*v
+			gold += tprice*v
+
+		else:
+			code = 0
+			v = 0
+
+		codes[i] = code
+		trade_price[i] = tprice
+		volume[i] = v
+		regionbank[i] = regional
+		wowbank[i] = gold
+		taper[i] = t
+
+	return prior_val, model_pred, regional, gold, code, v
+
+
+def _compile():
+	# _loop compiled with Numba, on first use. The loop and its helpers are compiled
+	# from copies that call each other's compiled versions, so the functions above
+	# stay plain Python for jit=False.
+	global _compiled
+	if _compiled is None:
+		namespace = dict(globals())
+		for name in ("_derivative", "_bisect", "_cost", "_affordable", "_loop"):
+			fn = globals()[name]
+			namespace[name] = njit(cache=CACHE)(types.FunctionType(fn.__code__, namespace, name, fn.__defaults__))
+		_compiled = namespace["_loop"]
+	return _compiled
+
+
+class Loop:
+	'''
+	The trading loop of algo.algo over blocks of prices. Model state, balances and
+	the last decision carry from one run() to the next, so a series can be fed in
+	pieces (e.g. algo.read_blocks) with the same result as all at once.
+
+	jit: use the Numba compiled loop. Defaults to JIT; False runs the same loop as
+	plain Python.
+	'''
+	def __init__(self, start_regional, start_gold, token, model=None, warmup=engine.WARMUP, jit=None):
+		if jit is None:
+			jit = JIT
+		elif jit and not JIT:
+			raise ImportError("jit=True needs numba")
+		self.jit = jit
+		self.model = ARIMA() if model is None else model
+		self.token = token
+		self.warmup = warmup
+		self.regional = float(start_regional)
+		self.gold = float(start_gold)
+		self.code = HOLD
+		self.volume = 0
+		self.price = np.nan
+		self.seen = 0
+
+	def run(self, price, time=None):
+		'''
+		Trade a block of prices. Returns a DataFrame with the columns of
+		engine.simulate, warm-up ticks included.
+		'''
+		price = np.asarray(price, dtype=float)
+		n = len(price)
+		state = self.model.get_state()
+		hold = max(0, min(self.warmup - self.seen, n))
+
+		prediction = np.empty(n)
+		codes = np.zeros(n, dtype=np.int8)
+		trade_price = np.empty(n)
+		volume = np.zeros(n, dtype=np.int64)
+		regional = np.empty(n)
+		gold = np.empty(n)
+		taper = np.zeros(n, dtype=np.int64)
+
+		if self.jit:
+			inputs = (price, self.model.ar_params, self.model.ma_params,
+					np.array(state["ar_vals"]), np.array(state["ma_vals"]))
+			outputs = (prediction, codes, trade_price, volume, regional, gold, taper)
+		else:
+			# Python floats, not numpy scalars, so the arithmetic is Python's
+			inputs = (price.tolist(), self.model.ar_params.tolist(), self.model.ma_params.tolist(),
+					state["ar_vals"], state["ma_vals"])
+			outputs = [[0]*n for k in range(7)]
+
+		ar_vals, ma_vals = inputs[3], inputs[4]
+		loop = _compile() if self.jit else _loop
+		result = loop(*inputs, float(state["prior_val"]), float(state["prediction"]), self.regional,
+					self.gold, int(self.code), int(self.volume), float(self.token), hold, evaluator.Opt.cr,
+					evaluator.Opt.tolerr, evaluator.Opt.maxiter, *outputs)
+		prior_val, model_pred, self.regional, self.gold, code, volume_ = result
+		self.code, self.volume = int(code), int(volume_)
+
+		if not self.jit:
+			for array, values in zip((prediction, codes, trade_price, volume, regional, gold, taper), outputs):
+				array[:] = values
+
+		state.update(ar_vals=list(ar_vals), ma_vals=list(ma_vals), prior_val=prior_val, prediction=model_pred)
+		self.model.set_state(state)
+		prior_price = np.concatenate(([self.price], price[:-1]))
+		if n:
+			self.price = price[-1]
+		self.seen += n
+
+		return pd.DataFrame({"market_price": price,
+							"prior_price": prior_price,
+							"prediction": prediction,
+							"trade": pd.Categorical.from_codes(codes, TRADETYPES),
+							"tradeprice": trade_price,
+							"volume": volume,
+							"regionbank": regional,
+							"wowbank": gold,
+							"taper": taper},
+							index=time)
+
+	@property
+	def value(self):
+		return self.regional + evaluator.gold_to_regional(self.gold, self.price/self.token)
+
+
+def backtest(price, start_regional, start_gold, token, time=None, model=None, jit=None):
+	'''
+	engine.backtest with the fused loop
+	'''
+	loop = Loop(start_regional, start_gold, token, model=model, jit=jit)
+	return loop.run(price, time=time).iloc[loop.warmup:]
+
+
+if __name__ == '__main__':
+	import algo
+
+	time, price = algo.get_series("eu-token-full.csv")
+	result = backtest(price, 1000, 200000, 20, time=time)
+	print(engine.final_value(result, 20))
@@ -0,0 +1,288 @@
+'''
+Live streaming mode.
+
+Consumes ticks as they arrive and runs the same ARIMA -> evaluate -> settle chain as
+algo.algo, one tick at a time. Memory stays constant however long the feed runs:
+	- the model and accounts only keep their current state
+	- ticks wait in a bounded queue. A full queue stops the feed from being read, so a
+	  socket feed is throttled by TCP instead of buffering
+	- decided rows wait in a second bounded queue for the recorder. If the recorder
+	  falls behind, trading pauses until it catches up
+	- decision latency is kept in a fixed-size window of recent ticks
+
+Feeds are async iterators of (time, price):
+	tail 		:: 	follows a growing "time,price" CSV file
+	connect 	:: 	reads "time,price" lines from a TCP socket
+	replay 		:: 	yields rows from arrays, optionally paced
+
+serve starts a local TCP stand-in feed that plays back arrays, for trying the socket
+path without a real price source.
+'''
+
+import asyncio
+import time as _time
+import numpy as np
+import accounts
+import evaluator
+import recorder
+import settlement
+import utils
+from model import ARIMA
+
+
+class LatencyTracker:
+	'''
+	Keeps the last 'size' per-tick latencies (seconds) and reports percentiles of them
+	'''
+	def __init__(self, size=10000):
+		self._buf = np.empty(size)
+		self._size = size
+		self.count = 0
+
+	def add(self, seconds):
+		self._buf[self.count % self._size] = seconds
+		self.count += 1
+
+	def percentiles(self, q=(50, 90, 99)):
+		window = self._buf[:min(self.count, self._size)]
+		if len(window) == 0:
+			return {}
+		out = {f"p{p}": float(v) for p, v in zip(q, np.percentile(window, q))}
+		out["max"] = float(window.max())
+		out["ticks"] = self.count
+		return out
+
+
+class Trader:
+	'''
+	Incremental version of the algo.algo loop body. tick() takes one price and returns
+	the decision and taper for it, or None while the model is warming up.
+	'''
+	def __init__(self, start_regional, region, start_gold, token, model=None):
+		self.model 		= ARIMA() if model is None else model
+		self.regionbank	= accounts.Account(start_regional, region)
+		self.wowbank	= accounts.Account(start_gold, "WoW")
+		self.token 		= token
+		self.ticks 		= 0
+		self.price 		= None
+
+		self.dcs = evaluator.Decision(p0=0,
+									p1=0,
+									pred=0,
+									tradetype="hold",
+									tprice=0,
+									volume=0)
+
+	def tick(self, price):
+		pred = self.model.next(price)
+		i = self.ticks
+		self.ticks += 1
+		self.price = price
+
+		# Need to load the model with initial values
+		if i < 5:
+			self.dcs = evaluator.Decision(p0=price,
+										p1=price,
+										pred=pred,
+										tradetype="hold",
+										tprice=price,
+										volume=0)
+			return None
+
+		self.dcs = evaluator.evaluate(mp=price,
+									prediction=price+pred,
+									regionbank=self.regionbank,
+									prior_dcs=self.dcs,
+									token=self.token)
+
+		taper = settlement.settle(self.dcs, price, self.token, self.regionbank, self.wowbank)
+		return self.dcs, taper
+
+	@property
+	def value(self):
+		'''
+		Value of both accounts in regional currency at the last price
+		'''
+		return self.regionbank.value + evaluator.gold_to_regional(self.wowbank.value, self.price/self.token)
+
+
+def _parse(line):
+	time, price = line.strip().split(",")[:2]
+	return time, float(price)
+
+
+async def tail(path, poll=0.25, header=True, idle_timeout=None):
+	'''
+	Follow a "time,price" CSV file as it grows. Stops after 'idle_timeout' seconds
+	without new lines, or never if it's None.
+	'''
+	with open(path, "r") as f:
+		if header:
+			f.readline()
+		partial = ""
+		idle = 0.0
+		while True:
+			line = f.readline()
+			if not line:
+				if idle_timeout is not None and idle >= idle_timeout:
+					return
+				await asyncio.sleep(poll)
+				idle += poll
+				continue
+
+			idle = 0.0
+			line = partial + line
+			# The writer may not have finished the line yet
+			if not line.endswith("\n"):
+				partial = line
+				continue
+			partial = ""
+			if line.strip():
+				yield _parse(line)
+
+
+async def connect(host, port):
+	'''
+	Read "time,price" lines from a TCP socket until the other side closes it
+	'''
+	reader, writer = await asyncio.open_connection(host, port)
+	try:
+		while True:
+			line = await reader.readline()
+			if not line:
+				return
+			if line.strip():
+				yield _parse(line.decode())
+	finally:
+		writer.close()
+
+
+async def replay(times, prices, interval=0.0):
+	for time, price in zip(times, prices):
+		yield time, float(price)
+		await asyncio.sleep(interval)
+
+
+async def serve(times, prices, host="127.0.0.1", port=0, interval=0.0):
+	'''
+	Local stand-in feed. Every connection is sent the full series as "time,price"
+	lines, then closed. Returns the asyncio server; the bound port is
+	server.sockets[0].getsockname()[1].
+	'''
+	async def handle(reader, writer):
+		try:
+			for time, price in zip(times, prices):
+				writer.write(f"{time},{price}\n".encode())
+				await writer.drain()
+				if interval:
+					await asyncio.sleep(interval)
+		finally:
+			writer.close()
+
+	return await asyncio.start_server(handle, host, port)
+
+
+async def run(feed, trader, records=None, maxsize=1024, latency=None):
+	'''
+	feed: async iterator of (time, price)
+	trader: Trader
+	records: optional recorder.Batch the decided rows are written to. Writing
+		happens on a worker thread so the event loop never waits on the disk.
+
+	Returns the LatencyTracker. Latency is measured from the moment a tick is read
+	off the feed until its decision is settled, so it includes time spent queued.
+	'''
+	latency = LatencyTracker() if latency is None else latency
+	ticks = asyncio.Queue(maxsize)
+	rows = asyncio.Queue(maxsize)
+
+	async def produce():
+		try:
+			async for time, price in feed:
+				await ticks.put((time, price, _time.perf_counter()))
+		finally:
+			await ticks.put(None)
+
+	async def consume():
+		timer = utils.Timer()
+		try:
+			while True:
+				item = await ticks.get()
+				if item is None:
+					return
+				time, price, arrived = item
+
+				timer.start()
+				out = trader.tick(price)
+				runtime = timer.stop()
+				if out is None:
+					continue
+				latency.add(_time.perf_counter() - arrived)
+
+				if records is not None:
+					dcs, taper = out
+					await rows.put(dict(time=time,
+										regionbank=_snapshot(trader.regionbank),
+										wowbank=_snapshot(trader.wowbank),
+										dcs=dcs,
+										taper=taper,
+										runtime=runtime))
+		finally:
+			await rows.put(None)
+
+	async def write():
+		done = False
+		while not done:
+			batch = [await rows.get()]
+			# Take everything that's already waiting and record it in one thread hop
+			while not rows.empty() and len(batch) < maxsize:
+				batch.append(rows.get_nowait())
+			if batch[-1] is None:
+				done = True
+				batch.pop()
+			if batch and records is not None:
+				await asyncio.to_thread(_record, records, batch)
+
+	await asyncio.gather(produce(), consume(), write())
+	return latency
+
+
+def _snapshot(account):
+	# Balances are recorded as of this tick, not as of when the writer gets to them
+	return accounts.CurrencyBase(account.value, account.name)
+
+
+def _record(records, batch):
+	for row in batch:
+		records.record(**row)
+
+
+def live(source, start_regional, region, start_gold, token, outfile, mode="npy", **kwargs):
+	'''
+	source: a path to tail, or a (host, port) pair to read from
+	kwargs are passed to tail or connect
+	'''
+	if isinstance(source, tuple):
+		feed = connect(*source)
+	else:
+		feed = tail(utils.PathResolver().search(source, filepath=True), **kwargs)
+
+	trader = Trader(start_regional, region, start_gold, token)
+	records = recorder.Batch(fn=outfile, dirpath="data", mode=mode)
+	try:
+		latency = asyncio.run(run(feed, trader, records))
+	finally:
+		records.close()
+
+	print(trader.value)
+	print(latency.percentiles())
+	return trader, latency
+
+
+if __name__ == '__main__':
+	live(source="eu-token-full.csv",
+		start_regional=1000,
+		region="EU",
+		start_gold=200000,
+		token=20,
+		outfile="liverun.npy")
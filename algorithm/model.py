@@ -3,17 +3,70 @@ import numpy as np
 class ARIMA:
 	def __init__(self, ar_params=[1.676390, -0.613328, 0.675564, -1.317306, 0.556450],
 						ma_params=[-1.133462, 0.119313, -0.767581, 0.924096, -0.136754]):
-		self.ar_params 	= np.array(ar_params)
-		self.ma_params 	= np.array(ma_params)
+		self.ar_params 	= np.array(ar_params, dtype=float)
+		self.ma_params 	= np.array(ma_params, dtype=float)
 
-		self.ar_vals	= np.array([0]*len(ar_params))
-		self.ma_vals	= np.array([0]*len(ma_params))
+		# AR and MA values are kept in mirrored ring buffers. Every value is written twice,
+		# p positions apart, so the p latest values are always the contiguous slice
+		# buf[head:head+p] (newest first). The slices are built once up front, so
+		# updating and predicting don't allocate any arrays.
+		self._ar_buf, self._ar_windows = self._ring(len(ar_params))
+		self._ma_buf, self._ma_windows = self._ring(len(ma_params))
+		self._ar_head	= 0
+		self._ma_head	= 0
+		self._ar_prod	= np.empty(len(ar_params))
+		self._ma_prod	= np.empty(len(ma_params))
 
 		self.prediction = 0
 		self.prior_val = 0
 
+	@staticmethod
+	def _ring(size):
+		buf = np.zeros(2*size)
+		windows = [buf[i:i+size] for i in range(max(size, 1))]
+		return buf, windows
+
+	@staticmethod
+	def _push(buf, head, value):
+		size = len(buf) // 2
+		if size == 0:
+			return head
+		head = (head - 1) % size
+		# Values are stored truncated to integers, like the integer arrays the
+		# model state used to be kept in
+		buf[head] = buf[head + size] = int(value)
+		return head
+
+	@staticmethod
+	def _load(buf, values):
+		# Replace the ring contents with 'values' (newest first) and reset the head
+		size = len(buf) // 2
+		buf[:size] = values
+		buf[size:] = values
+		return 0
+
+	@property
+	def ar_vals(self):
+		return self._ar_windows[self._ar_head]
+
+	@property
+	def ma_vals(self):
+		return self._ma_windows[self._ma_head]
+
+	@staticmethod
+	def _dot(params, vals, prod):
+		# Products summed one at a time, newest lag first, the same order filter()
+		# uses. sum() would add 8 or more terms pairwise, which can differ in the
+		# last bit, and the truncated state carries such differences on.
+		if len(prod) == 0:
+			return 0.0
+		np.multiply(params, vals, out=prod)
+		return np.add.accumulate(prod, out=prod)[-1]
+
 	def predict(self):
-		return np.dot(self.ar_params, self.ar_vals) + np.dot(self.ma_params, self.ma_vals)
+		ar = self._dot(self.ar_params, self.ar_vals, self._ar_prod)
+		ma = self._dot(self.ma_params, self.ma_vals, self._ma_prod)
+		return ar + ma
 
 	def compute_error(self, value):
 		return value - self.prediction
@@ -21,11 +74,9 @@ class ARIMA:
 	def update_priors(self, value):
 		error = self.compute_error(value)
 
-		# Shift AR and MA values and insert latest values to the front of arrays
-		self.ar_vals = self.ar_vals[:-1]
-		self.ar_vals = np.insert(self.ar_vals, 0, values=value)
-		self.ma_vals = self.ma_vals[:-1]
-		self.ma_vals = np.insert(self.ma_vals, 0, values=error)
+		# Insert latest values to the front of the AR and MA windows
+		self._ar_head = self._push(self._ar_buf, self._ar_head, value)
+		self._ma_head = self._push(self._ma_buf, self._ma_head, error)
 
 	def next(self, value):
 		diff = value - self.prior_val
@@ -34,4 +85,429 @@ class ARIMA:
 		self.prior_val = value
 		return self.prediction
 
+	def filter(self, series):
+		'''
+		Runs the model over a whole series and returns the one-step prediction made after
+		each value, exactly as calling next() on every value would. The model state is
+		left at the end of the series.
+
+		The AR terms only depend on the price changes, so they are computed for the whole
+		series at once. The MA terms depend on the errors of earlier predictions, so that
+		recursion runs as a scalar loop.
+		'''
+		series = np.asarray(series, dtype=float)
+		n = len(series)
+		out = np.empty(n)
+		if n == 0:
+			return out
+
+		p = len(self.ar_params)
+		diffs = np.diff(series, prepend=self.prior_val)
+
+		# Oldest to newest: the current AR window followed by the truncated changes
+		history = np.concatenate((self.ar_vals[::-1], np.trunc(diffs)))
+		ar = np.zeros(n)
+		for k, param in enumerate(self.ar_params.tolist()):
+			ar += param * history[p-k:p-k+n]
+
+		ma_params = self.ma_params.tolist()
+		q = len(ma_params)
+		errors = self.ma_vals.tolist()
+		pred = float(self.prediction)
+		changes = diffs.tolist()
+
+		for t, ar_t in enumerate(ar.tolist()):
+			if q:
+				errors.pop()
+				errors.insert(0, float(int(changes[t] - pred)))
+			ma = 0.0
+			for k in range(q):
+				ma += ma_params[k] * errors[k]
+			pred = ar_t + ma
+			out[t] = pred
+
+		self._ar_head = self._load(self._ar_buf, history[:-p-1:-1] if p else history[:0])
+		self._ma_head = self._load(self._ma_buf, errors)
+		self.prediction = out[-1]
+		self.prior_val = series[-1]
+		return out
+
+	def get_state(self):
+		'''
+		Coefficients and model state as plain lists and floats, e.g. for a checkpoint
+		'''
+		return {"ar_params": self.ar_params.tolist(),
+				"ma_params": self.ma_params.tolist(),
+				"ar_vals": self.ar_vals.tolist(),
+				"ma_vals": self.ma_vals.tolist(),
+				"prediction": float(self.prediction),
+				"prior_val": float(self.prior_val)}
+
+	def set_state(self, state):
+		'''
+		Restore what get_state() returned. The model continues exactly where that
+		model was.
+		'''
+		self.set_params(state["ar_params"], state["ma_params"])
+		self._ar_head = self._load(self._ar_buf, state["ar_vals"])
+		self._ma_head = self._load(self._ma_buf, state["ma_vals"])
+		self.prediction = state["prediction"]
+		self.prior_val = state["prior_val"]
+
+	def set_params(self, ar_params, ma_params):
+		'''
+		Swap in new coefficients of the same orders, keeping the model state
+		'''
+		self.ar_params[:] = ar_params
+		self.ma_params[:] = ma_params
+
+	def filter_rolling(self, series, window, step, fitter=None):
+		'''
+		filter() with periodic refits. After every 'step' values the coefficients are
+		refit on the latest 'window' values seen so far (warm started from the
+		previous fit), so the model can follow regime changes without ever using
+		values it hasn't predicted yet.
+
+		Returns the predictions and the list of (index, Fit) refits, where 'index' is
+		the position of the first value predicted with that fit.
+		'''
+		series = np.asarray(series, dtype=float)
+		if fitter is None:
+			fitter = RollingFit(p=len(self.ar_params), q=len(self.ma_params),
+								ar_params=self.ar_params, ma_params=self.ma_params)
+
+		out = np.empty(len(series))
+		fits = []
+		for start in range(0, len(series), step):
+			end = min(start + step, len(series))
+			out[start:end] = self.filter(series[start:end])
+
+			history = series[max(0, end - window):end]
+			if end < len(series) and len(history) > fitter.minimum:
+				fit = fitter.update(history)
+				self.set_params(fit.ar_params, fit.ma_params)
+				fits.append((end, fit))
+
+		return out, fits
+
+
+
+class Ensemble:
+	'''
+	K ARIMA models run side by side on the same series.
+
+	The state of all K models is one 2-D buffer, a row per model: the last P price
+	changes (shared, P the largest AR order) followed by that model's last Q errors
+	(Q the largest MA order). The coefficients are a matching K x (P+Q) array, with
+	lower order models zero-padded. Each tick shifts the buffer once for all models
+	and computes all K predictions at once, a column of the two arrays at a time.
+
+	Each row predicts exactly what that model would on its own. The state is
+	truncated to integers like ARIMA's, so a last-bit difference in a prediction
+	can change a stored error and carry on from there. The sums are therefore
+	taken like ARIMA.predict's: the AR and MA terms separately, each newest lag
+	first, then added.
+
+	The K predictions are combined into one:
+		mean 		:: 	average of the models
+		weighted 	:: 	weighted average with fixed 'weights'
+		best 		:: 	the model with the lowest recent squared error, tracked as an
+						exponential average over about 'window' ticks
+	'''
+	COMBINE = ("mean", "weighted", "best")
+
+	def __init__(self, models, combine="mean", weights=None, window=50):
+		'''
+		models: ARIMA objects or (ar_params, ma_params) pairs. Only their coefficients
+		are used; the ensemble starts from a fresh state.
+		'''
+		if combine not in self.COMBINE:
+			raise ValueError(f"Unknown combination {combine!r}, expected one of {', '.join(self.COMBINE)}")
+		params = [(m.ar_params, m.ma_params) if isinstance(m, ARIMA) else m for m in models]
+		k = len(params)
+		self.p = max(len(ar) for ar, ma in params)
+		self.q = max(len(ma) for ar, ma in params)
+
+		self.coef = np.zeros((k, self.p + self.q))
+		for i, (ar, ma) in enumerate(params):
+			self.coef[i, :len(ar)] = ar
+			self.coef[i, self.p:self.p + len(ma)] = ma
+		self.state = np.zeros((k, self.p + self.q))
+
+		if combine == "weighted":
+			if weights is None or len(weights) != k:
+				raise ValueError("'weighted' needs one weight per model")
+			weights = np.asarray(weights, dtype=float)
+			self.weights = weights / weights.sum()
+		else:
+			self.weights = None
+		self.combine = combine
+		self.alpha = 2 / (window + 1)
+		self.mse = np.zeros(k)
+
+		self.predictions = np.zeros(k)
+		self.prediction = 0.0
+		self.prior_val = 0
+		self._seen = 0
+
+	def __len__(self):
+		return len(self.coef)
+
+	def _step(self, diff):
+		p, q = self.p, self.q
+		state = self.state
+		errors = diff - self.predictions
+		if self._seen:
+			a = self.alpha
+			self.mse = (1 - a)*self.mse + a*errors*errors
+		self._seen += 1
+
+		if p:
+			state[:, 1:p] = state[:, :p-1]
+			state[:, 0] = int(diff)
+		if q:
+			state[:, p+1:] = state[:, p:-1]
+			state[:, p] = np.trunc(errors)
+		coef = self.coef
+		ar = np.zeros(len(coef))
+		for k in range(p):
+			ar += coef[:, k] * state[:, k]
+		ma = np.zeros(len(coef))
+		for k in range(p, p + q):
+			ma += coef[:, k] * state[:, k]
+		self.predictions = ar + ma
+		return self.predictions
+
+	def _combined(self, predictions):
+		if self.combine == "mean":
+			return predictions.mean()
+		if self.combine == "weighted":
+			return predictions @ self.weights
+		return predictions[np.argmin(self.mse)]
+
+	def next(self, value):
+		'''
+		Feed one price. Returns the combined prediction of the next price change; the
+		K predictions are in self.predictions.
+		'''
+		predictions = self._step(value - self.prior_val)
+		self.prior_val = value
+		self.prediction = self._combined(predictions)
+		return self.prediction
+
+	def filter(self, series, full=False):
+		'''
+		next() over a whole series. Returns the combined predictions, and with
+		full=True also the (len(series), K) array of every model's predictions.
+		'''
+		series = np.asarray(series, dtype=float)
+		n = len(series)
+		combined = np.empty(n)
+		out = np.empty((n, len(self))) if full else None
+		prior = self.prior_val
+		for t, value in enumerate(series.tolist()):
+			predictions = self._step(value - prior)
+			prior = value
+			combined[t] = self._combined(predictions)
+			if full:
+				out[t] = predictions
+
+		self.prior_val = prior
+		if n:
+			self.prediction = combined[-1]
+		return (combined, out) if full else combined
+
+
+'''
+Conditional sum of squares (CSS) fitting.
+
+The model predicts the next price change d from the last p changes and the last q
+prediction errors e:
+	e_t = d_t - sum_k(a_k * d_(t-1-k)) - sum_k(m_k * e_(t-1-k))
+CSS picks the a, m minimizing sum(e_t^2), with errors before the first p changes
+set to 0. The fit uses exact changes; the integer truncation of ARIMA's state is
+left out.
+
+The error recursion is an all-pole filter 1/(1 + m_0*z^-1 + ... + m_(q-1)*z^-q)
+applied to the AR residuals. With invertible MA coefficients its impulse response
+decays, so the filter is applied to whole columns at once as an FFT convolution
+with the truncated impulse response. The Gauss-Newton Jacobian columns follow the
+same filter, so each iteration is a handful of array operations whatever the
+series length.
+'''
+
+def _lags(x, n_lags, start):
+	# Column k holds x_(t-1-k) for t = start..len(x)-1
+	n = len(x) - start
+	out = np.empty((n, n_lags))
+	for k in range(n_lags):
+		out[:, k] = x[start-1-k:start-1-k+n]
+	return out
+
+
+def _invertible(ma_params, margin=0.999):
+	# Reflect roots of z^q + m_0*z^(q-1) + ... + m_(q-1) into the unit circle
+	if len(ma_params) == 0:
+		return np.asarray(ma_params, dtype=float)
+	roots = np.roots(np.concatenate(([1.0], ma_params)))
+	outside = np.abs(roots) >= 1
+	if not outside.any():
+		return np.asarray(ma_params, dtype=float)
+	roots[outside] = margin / np.conj(roots[outside])
+	return np.real(np.poly(roots))[1:]
+
+
+def _impulse(ma_params, n, tol=1e-12):
+	h = np.zeros(n)
+	h[0] = 1.0
+	q = len(ma_params)
+	for s in range(1, n):
+		acc = 0.0
+		for k in range(min(q, s)):
+			acc -= ma_params[k] * h[s-1-k]
+		h[s] = acc
+		# Stop once the last q taps have died out
+		if s >= q and np.abs(h[s-q+1:s+1]).max() < tol:
+			return h[:s+1]
+	return h
+
+
+def _recursive_filter(x, ma_params):
+	# y_t = x_t - sum_k(m_k * y_(t-1-k)), down the columns of x
+	n = len(x)
+	h = _impulse(list(ma_params), n)
+	if len(h) <= 32:
+		# Short responses are cheaper as a direct sum of shifted columns
+		y = x.copy()
+		for k in range(1, len(h)):
+			y[k:] += h[k] * x[:-k]
+		return y
+
+	size = 1 << int(n + len(h) - 1).bit_length()
+	fx = np.fft.rfft(x, size, axis=0)
+	fh = np.fft.rfft(h, size)
+	if x.ndim > 1:
+		fh = fh[:, None]
+	return np.fft.irfft(fx * fh, size, axis=0)[:n]
+
+
+def _css(d, p, q, ar_params, ma_params):
+	X = _lags(d, p, p)
+	r = d[p:] - X @ ar_params
+	e = _recursive_filter(r, ma_params) if q else r
+	return X, e
+
+
+class Fit:
+	def __init__(self, ar_params, ma_params, sse, n, iterations, converged):
+		self.ar_params	= ar_params
+		self.ma_params	= ma_params
+		self.sse		= sse
+		self.sigma2		= sse / max(n, 1)
+		self.iterations	= iterations
+		self.converged	= converged
+
+	def model(self):
+		return ARIMA(ar_params=list(self.ar_params), ma_params=list(self.ma_params))
+
+	def __repr__(self):
+		return f"Fit(ar={np.round(self.ar_params, 6).tolist()}, ma={np.round(self.ma_params, 6).tolist()}, sigma2={self.sigma2:.6g})"
+
+
+def _initial(d, p, q):
+	'''
+	Hannan-Rissanen start: a long AR regression estimates the errors, then the changes
+	are regressed on their own lags and the lagged error estimates
+	'''
+	long = min(max(2*(p + q), 20), len(d) // 4)
+	X = _lags(d, long, long)
+	phi = np.linalg.lstsq(X, d[long:], rcond=None)[0]
+	e = np.zeros(len(d))
+	e[long:] = d[long:] - X @ phi
+
+	start = long + q
+	Z = np.hstack((_lags(d, p, start), _lags(e, q, start)))
+	beta = np.linalg.lstsq(Z, d[start:], rcond=None)[0]
+	return beta[:p], _invertible(beta[p:])
+
+
+def fit(series, p=5, q=5, ar_params=None, ma_params=None, maxiter=50, tol=1e-8):
+	'''
+	Estimate ar_params/ma_params from a price series by conditional sum of squares.
+
+	ar_params, ma_params: warm start. Without them the search starts from a
+	Hannan-Rissanen estimate.
+	'''
+	d = np.diff(np.asarray(series, dtype=float))
+	if len(d) <= 2*(p + q) + 1:
+		raise ValueError(f"Need more than {2*(p + q) + 2} prices to fit p={p}, q={q}")
+
+	if ar_params is None or ma_params is None:
+		a, m = _initial(d, p, q)
+	else:
+		a = np.array(ar_params, dtype=float)
+		m = _invertible(np.array(ma_params, dtype=float))
+
+	X, e = _css(d, p, q, a, m)
+	sse = e @ e
+	damping = 1e-3
+	converged = False
+	for i in range(maxiter):
+		# Jacobian of the errors; every column goes through the error filter
+		# Errors before the first one are 0; q may be larger than p
+		r = max(p, q)
+		lagged = np.hstack((X, _lags(np.concatenate((np.zeros(r), e)), q, r))) if q else X
+		J = -_recursive_filter(lagged, m) if q else -lagged
+
+		JTJ = J.T @ J
+		grad = J.T @ e
+		while True:
+			step = np.linalg.solve(JTJ + damping*np.diag(np.diag(JTJ) + 1e-12), -grad)
+			a_new = a + step[:p]
+			m_new = _invertible(m + step[p:])
+			X_new, e_new = _css(d, p, q, a_new, m_new)
+			sse_new = e_new @ e_new
+			if sse_new <= sse or damping > 1e8:
+				break
+			damping *= 10
+
+		if sse_new > sse:
+			converged = True
+			break
+
+		improvement = (sse - sse_new) / max(sse, 1e-300)
+		a, m, X, e, sse = a_new, m_new, X_new, e_new, sse_new
+		damping = max(damping / 10, 1e-9)
+		if improvement < tol:
+			converged = True
+			break
+
+	return Fit(a, m, sse, len(e), i + 1, converged)
+
+
+class RollingFit:
+	'''
+	Refits on successive windows, starting each fit from the previous solution. A
+	small 'maxiter' is usually enough since neighbouring windows share most of
+	their data.
+	'''
+	def __init__(self, p=5, q=5, ar_params=None, ma_params=None, maxiter=5, tol=1e-8):
+		self.p 			= p
+		self.q 			= q
+		self.maxiter	= maxiter
+		self.tol		= tol
+		self.last		= None
+		self.minimum	= 2*(p + q) + 2
+		if ar_params is not None and ma_params is not None:
+			self.last = Fit(np.array(ar_params, dtype=float), np.array(ma_params, dtype=float), np.nan, 0, 0, False)
 
+	def update(self, series):
+		if self.last is None:
+			self.last = fit(series, self.p, self.q, tol=self.tol)
+		else:
+			self.last = fit(series, self.p, self.q,
+							ar_params=self.last.ar_params,
+							ma_params=self.last.ma_params,
+							maxiter=self.maxiter,
+							tol=self.tol)
+		return self.last
@@ -0,0 +1,250 @@
+'''
+Monte Carlo simulation of the strategy.
+
+Synthetic price paths are generated from the historical series, either by
+	- block bootstrap: blocks of consecutive historical price changes are drawn with
+	  replacement and chained, which keeps the short range dependence the model
+	  trades on, or
+	- ARIMA: price changes are simulated from ARIMA coefficients fit (CSS) on the
+	  history, with normal innovations of the fitted variance.
+
+The strategy then runs on every path at once. Prices and predictions are
+(paths x time) arrays and the trading loop steps through time, settling all paths of
+a tick with array operations. Each path is traded exactly as engine.backtest would
+trade it on its own: a fresh ARIMA, WARMUP ticks of holds, then evaluate and settle.
+
+The result is one row of statistics per path (final value, drawdown, trade counts),
+summarized into a distribution by summarize().
+'''
+
+import numpy as np
+import pandas as pd
+import engine
+import evaluator
+import model as arima
+import settlement
+from model import ARIMA
+
+
+def bootstrap(pdelta, n_paths, length, start, block=72, rng=None):
+	'''
+	Price paths built from blocks of 'block' consecutive changes of 'pdelta', drawn
+	with replacement. Every path starts from 'start'.
+	'''
+	rng = np.random.default_rng(rng)
+	pdelta = np.asarray(pdelta, dtype=float)
+	block = min(block, len(pdelta))
+	n_blocks = -(-length // block)
+
+	starts = rng.integers(0, len(pdelta) - block + 1, size=(n_paths, n_blocks))
+	idx = (starts[:, :, None] + np.arange(block)).reshape(n_paths, -1)[:, :length]
+	return _prices(start, pdelta[idx])
+
+
+def arima_paths(history, n_paths, length, p=5, q=5, fit=None, rng=None):
+	'''
+	Price paths continuing 'history' with changes simulated from an ARIMA(p, 1, q)
+	fit on it. A model.Fit can be passed instead to skip the fit.
+	'''
+	rng = np.random.default_rng(rng)
+	history = np.asarray(history, dtype=float)
+	if fit is None:
+		fit = arima.fit(history, p, q)
+	ar = np.asarray(fit.ar_params, dtype=float)
+	ma = np.asarray(fit.ma_params, dtype=float)
+	p, q = len(ar), len(ma)
+
+	# Index p + t (resp. q + t) holds step t, with the last changes of the history
+	# before it
+	changes = np.zeros((n_paths, p + length))
+	recent = np.diff(history)[max(len(history) - 1 - p, 0):]
+	changes[:, p - len(recent):p] = recent
+	errors = np.zeros((n_paths, q + length))
+	shocks = rng.normal(0, np.sqrt(fit.sigma2), size=(n_paths, length))
+
+	for t in range(length):
+		d = shocks[:, t].copy()
+		for k in range(p):
+			d += ar[k] * changes[:, p + t - 1 - k]
+		for k in range(q):
+			d += ma[k] * errors[:, q + t - 1 - k]
+		changes[:, p + t] = d
+		errors[:, q + t] = shocks[:, t]
+
+	return _prices(history[-1], changes[:, p:])
+
+
+def _prices(start, changes):
+	# Token prices are whole gold and can't reach zero
+	return np.maximum(np.round(start + np.cumsum(changes, axis=1)), 1)
+
+
+def predict_paths(price, model=None):
+	'''
+	model.filter() on every row of 'price' at once. Each row starts from the state of
+	'model' (a fresh ARIMA by default), which is left untouched. Same predictions
+	as filtering each row on its own.
+	'''
+	if model is None:
+		model = ARIMA()
+	price = np.asarray(price, dtype=float)
+	n_paths, n = price.shape
+	ar_params = model.ar_params.tolist()
+	ma_params = model.ma_params.tolist()
+	p, q = len(ar_params), len(ma_params)
+
+	diffs = np.diff(price, axis=1, prepend=model.prior_val)
+	history = np.empty((n_paths, p + n))
+	history[:, :p] = model.ar_vals[::-1]
+	history[:, p:] = np.trunc(diffs)
+	ar = np.zeros((n_paths, n))
+	for k, param in enumerate(ar_params):
+		ar += param * history[:, p-k:p-k+n]
+
+	# errors[:, k] is the error k ticks back
+	errors = np.tile(np.asarray(model.ma_vals, dtype=float), (n_paths, 1))
+	pred = np.full(n_paths, float(model.prediction))
+	out = np.empty((n_paths, n))
+	for t in range(n):
+		if q:
+			errors[:, 1:] = errors[:, :-1]
+			errors[:, 0] = np.trunc(diffs[:, t] - pred)
+		ma = np.zeros(n_paths)
+		for k in range(q):
+			ma += ma_params[k] * errors[:, k]
+		pred = ar[:, t] + ma
+		out[:, t] = pred
+	return out
+
+
+def _compound(price, rate, volume):
+	# price*rate**volume with Python's float power, which numpy's doesn't always
+	# match in the last bit. Keeps every path identical to a scalar backtest.
+	return price * np.array([rate**v for v in volume.tolist()])
+
+
+def run_paths(price, start_regional, start_gold, token, model=None, warmup=engine.WARMUP):
+	'''
+	Trade every row of 'price' as its own backtest. Returns a DataFrame with one row
+	of statistics per path.
+	'''
+	price = np.asarray(price, dtype=float)
+	n_paths, n = price.shape
+	prediction = price + predict_paths(price, model)
+	signal = price > prediction
+	signal[:, :warmup] = False
+
+	regional = np.full(n_paths, float(start_regional))
+	gold = np.full(n_paths, float(start_gold))
+	volume = np.zeros(n_paths, dtype=np.int64)
+	bought = np.zeros(n_paths, dtype=bool)
+
+	buys = np.zeros(n_paths, dtype=np.int64)
+	traded = np.zeros(n_paths, dtype=np.int64)
+	taper = np.zeros(n_paths, dtype=np.int64)
+	start_value = regional + evaluator.gold_to_regional(gold, price[:, 0]/token)
+	peak = start_value.copy()
+	drawdown = np.zeros(n_paths)
+	value = start_value
+
+	for t in range(warmup, n):
+		mp = price[:, t]
+
+		# The tick after a buy sells it, otherwise a buy signal buys
+		sell = np.flatnonzero(bought)
+		buy = np.flatnonzero(signal[:, t] & ~bought)
+
+		if len(sell):
+			m = mp[sell]
+			v = volume[sell]
+			tprice = _compound(m, 1 + evaluator.Opt.cr, v)
+			cost = tprice * v
+			r = regional[sell]
+			g = gold[sell]
+
+			# Rare: the WoW account can't cover the sale
+			short = cost > g
+			for j in np.flatnonzero(short).tolist():
+				r[j], g[j], v[j], tprice[j], tp = settlement.sell(m[j], int(v[j]), tprice[j], token, r[j], g[j])
+				taper[sell[j]] += tp
+			covered = ~short
+			r[covered] += token * v[covered]
+			g[covered] -= cost[covered]
+
+			# Move profits to regional
+			q = np.where(g > m, np.trunc(g/m) - 1, 0)
+			regional[sell] = r + token*q
+			gold[sell] = g - q*m
+			bought[sell] = False
+
+		if len(buy):
+			m = mp[buy]
+			v = evaluator.Opt.solve(p0=prediction[buy, t], p1=m, xb=regional[buy]/token)
+			regional[buy] -= token * v
+			gold[buy] += _compound(m, 1 - evaluator.Opt.cr, v) * v
+			volume[buy] = v
+			bought[buy] = True
+			buys[buy] += 1
+			traded[buy] += v
+
+		value = regional + evaluator.gold_to_regional(gold, mp/token)
+		np.maximum(peak, value, out=peak)
+		np.maximum(drawdown, 1 - value/peak, out=drawdown)
+
+	return pd.DataFrame({"start_value": start_value,
+						"final_value": value,
+						"return": value/start_value - 1,
+						"max_drawdown": drawdown,
+						"buys": buys,
+						"sells": buys - bought,
+						"volume": traded,
+						"taper": taper})
+
+
+def monte_carlo(price, n_paths, start_regional, start_gold, token, length=None, method="bootstrap",
+				block=72, p=5, q=5, chunk=2500, seed=None, model=None):
+	'''
+	price: historical price series the paths are generated from
+	length: ticks per path, defaults to the length of the history
+	method: "bootstrap" or "arima"
+	chunk: paths generated and traded at a time, bounds the memory used
+
+	Returns the statistics of every path (see run_paths).
+	'''
+	price = np.asarray(price, dtype=float)
+	length = len(price) if length is None else length
+	rng = np.random.default_rng(seed)
+
+	if method == "bootstrap":
+		pdelta = np.diff(price)
+		generate = lambda n: bootstrap(pdelta, n, length, price[0], block=block, rng=rng)
+	elif method == "arima":
+		fit = arima.fit(price, p, q)
+		generate = lambda n: arima_paths(price, n, length, fit=fit, rng=rng)
+	else:
+		raise ValueError(f"Unknown path method {method!r}")
+
+	frames = []
+	for first in range(0, n_paths, chunk):
+		paths = generate(min(chunk, n_paths - first))
+		frames.append(run_paths(paths, start_regional, start_gold, token, model=model))
+	return pd.concat(frames, ignore_index=True)
+
+
+def summarize(stats, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+	'''
+	Mean, standard deviation and quantiles of every statistic across paths
+	'''
+	table = stats.quantile(list(quantiles)).T
+	table.columns = [f"q{int(round(100*x)):02d}" for x in quantiles]
+	table.insert(0, "std", stats.std())
+	table.insert(0, "mean", stats.mean())
+	return table
+
+
+if __name__ == '__main__':
+	import algo
+
+	time, price = algo.get_series("eu-token-full.csv")
+	stats = monte_carlo(price, n_paths=10000, start_regional=1000, start_gold=200000, token=20, seed=0)
+	print(summarize(stats).to_string())
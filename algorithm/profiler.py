@@ -0,0 +1,127 @@
+'''
+Per-stage profiling of the trading loop.
+
+A Profiler keeps, for each named stage, a call count, total/min/max time and a
+histogram of durations in power-of-two nanosecond buckets, plus free-form counters.
+Stages are timed with lap(), which closes one stage and returns the start of the next:
+
+	t = profiler.clock()
+	pred = model.next(price)
+	t = profiler.lap("predict", t)
+
+Loops take profiler=None by default and guard every call with "if profiler is not
+None", so a run without a profiler pays one comparison per stage and nothing else.
+
+The stages algo.algo reports are predict, evaluate, optimize, settle and record.
+optimize (the volume search) runs inside evaluate, so its time is also part of
+evaluate's.
+'''
+
+import json
+from time import perf_counter_ns
+import pandas as pd
+
+
+STAGES = ("predict", "evaluate", "optimize", "settle", "record")
+
+# Bucket b holds durations of [2^(b-1), 2^b) nanoseconds
+BUCKETS = 64
+
+
+class Stage:
+	__slots__ = ("count", "total", "min", "max", "histogram")
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0
+		self.min = None
+		self.max = 0
+		self.histogram = [0]*BUCKETS
+
+	def add(self, ns):
+		self.count += 1
+		self.total += ns
+		if self.min is None or ns < self.min:
+			self.min = ns
+		if ns > self.max:
+			self.max = ns
+		self.histogram[min(ns.bit_length(), BUCKETS - 1)] += 1
+
+	def percentile(self, q):
+		'''
+		Upper edge of the bucket holding the q-th percentile, kept within [min, max]
+		'''
+		if self.count == 0:
+			return None
+		target = q/100 * self.count
+		seen = 0
+		for bucket, n in enumerate(self.histogram):
+			seen += n
+			if n and seen >= target:
+				return max(self.min, min(self.max, 2**bucket))
+		return self.max
+
+
+class Profiler:
+	clock = staticmethod(perf_counter_ns)
+
+	def __init__(self, stages=STAGES):
+		self.stages = {name: Stage() for name in stages}
+		self.counters = {}
+
+	def add(self, stage, ns):
+		if stage not in self.stages:
+			self.stages[stage] = Stage()
+		self.stages[stage].add(ns)
+
+	def lap(self, stage, start):
+		'''
+		Record the time since 'start' for 'stage' and return the start of the next stage.
+		The profiler's own bookkeeping falls between the two, so no stage pays for it.
+		'''
+		self.add(stage, perf_counter_ns() - start)
+		return perf_counter_ns()
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def summary(self):
+		'''
+		One row per stage. Times are in microseconds, 'share' is the stage's part of
+		the time spent in all stages.
+		'''
+		rows = []
+		for name, s in self.stages.items():
+			rows.append({"stage": name,
+						"count": s.count,
+						"total_s": s.total / 1e9,
+						"mean_us": s.total / s.count / 1e3 if s.count else None,
+						"p50_us": s.percentile(50) / 1e3 if s.count else None,
+						"p90_us": s.percentile(90) / 1e3 if s.count else None,
+						"p99_us": s.percentile(99) / 1e3 if s.count else None,
+						"max_us": s.max / 1e3 if s.count else None})
+
+		df = pd.DataFrame(rows).set_index("stage")
+		total = sum(s.total for name, s in self.stages.items() if name != "optimize")
+		df["share"] = df["total_s"] / (total / 1e9) if total else 0.0
+		return df
+
+	def dump(self, fp=None):
+		'''
+		Print the summary and counters, and write them with the raw histograms to 'fp'
+		as JSON if given
+		'''
+		print(self.summary().to_string())
+		if self.counters:
+			print(", ".join(f"{name}: {n}" for name, n in self.counters.items()))
+
+		if fp is not None:
+			out = {"stages": {name: {"count": s.count,
+									"total_ns": s.total,
+									"min_ns": s.min,
+									"max_ns": s.max,
+									"histogram": s.histogram}
+							for name, s in self.stages.items()},
+					"counters": self.counters}
+			with open(fp, "w") as f:
+				json.dump(out, f, indent=1)
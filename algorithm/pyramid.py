@@ -0,0 +1,128 @@
+'''
+Multi-resolution price pyramid.
+
+For a price file (CSV or binary store) the pyramid holds its prices resampled to
+coarser resolutions, as open/high/low/close bars with the number of ticks in each.
+Every level is built once from the source and cached on disk next to it:
+
+	<file>.pyramid/
+		meta.json 	:: 	source size and modification time the levels were built from
+		5min.npy
+		1h.npy
+		1d.npy
+
+Levels are structured arrays (BAR_DTYPE) opened memory-mapped, so a coarse run
+only reads its own, much smaller, level. Bars are labeled with the start of their
+interval in epoch seconds. Intervals without ticks have no bar.
+
+If the source file's size or modification time changes, the whole pyramid is
+rebuilt on next use.
+'''
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Level name -> pandas resampling rule
+RESOLUTIONS = {"5min": "5min",
+				"1h": "1h",
+				"1d": "1D"}
+
+BAR_DTYPE = np.dtype([("time", "<i8"),
+					("open", "<f8"),
+					("high", "<f8"),
+					("low", "<f8"),
+					("close", "<f8"),
+					("count", "<i8")])
+
+
+def _source(fp):
+	# Every tick of a price file as (epoch seconds, price) arrays
+	if fp.endswith(".bin"):
+		import algo
+		store = np.fromfile(fp, dtype=algo.PRICE_DTYPE)
+		return store["time"], store["price"]
+
+	df = pd.read_csv(fp, usecols=["time", "price"])
+	time = pd.to_datetime(df["time"]).to_numpy().astype("datetime64[s]").astype(np.int64)
+	return time, df["price"].to_numpy(dtype=float)
+
+
+def _signature(fp):
+	stat = os.stat(fp)
+	return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def resample(time, price, rule):
+	'''
+	OHLC bars of the ticks (time in epoch seconds) for a pandas resampling rule
+	'''
+	series = pd.Series(price, index=pd.to_datetime(time, unit="s"))
+	resampler = series.resample(rule, label="left", closed="left")
+	ohlc = resampler.ohlc()
+	count = resampler.count()
+	keep = (count > 0).to_numpy()
+
+	bars = np.empty(keep.sum(), dtype=BAR_DTYPE)
+	bars["time"] = ohlc.index.to_numpy()[keep].astype("datetime64[s]").astype(np.int64)
+	for name in ("open", "high", "low", "close"):
+		bars[name] = ohlc[name].to_numpy()[keep]
+	bars["count"] = count.to_numpy()[keep]
+	return bars
+
+
+class Pyramid:
+	def __init__(self, fp, resolutions=RESOLUTIONS):
+		self.fp = fp
+		self.resolutions = resolutions
+		self.dirpath = f"{fp}.pyramid"
+
+	def _meta_path(self):
+		return os.path.join(self.dirpath, "meta.json")
+
+	def _level_path(self, resolution):
+		return os.path.join(self.dirpath, f"{resolution}.npy")
+
+	def stale(self):
+		'''
+		True if the cached levels are missing or weren't built from the current source
+		'''
+		try:
+			with open(self._meta_path(), "r") as f:
+				meta = json.load(f)
+		except (OSError, ValueError):
+			return True
+		return (meta.get("source") != _signature(self.fp)
+				or any(not os.path.exists(self._level_path(r)) for r in self.resolutions))
+
+	def build(self):
+		'''
+		Resample the source to every level and write them. meta.json is written last,
+		so an interrupted build is rebuilt on next use.
+		'''
+		signature = _signature(self.fp)
+		time, price = _source(self.fp)
+		os.makedirs(self.dirpath, exist_ok=True)
+		if os.path.exists(self._meta_path()):
+			os.remove(self._meta_path())
+
+		for resolution, rule in self.resolutions.items():
+			np.save(self._level_path(resolution), resample(time, price, rule))
+
+		with open(self._meta_path(), "w") as f:
+			json.dump({"source": signature, "resolutions": self.resolutions}, f)
+
+	def level(self, resolution):
+		'''
+		Bars of one level, memory-mapped. Builds the pyramid first if it is stale.
+		'''
+		if resolution not in self.resolutions:
+			raise ValueError(f"Unknown resolution {resolution!r}, expected one of {', '.join(self.resolutions)}")
+		if self.stale():
+			self.build()
+		return np.load(self._level_path(resolution), mmap_mode="r")
+
+
+def load(fp, resolution):
+	return Pyramid(fp).level(resolution)
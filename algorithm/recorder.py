@@ -1,8 +1,235 @@
 import os
+import queue
+import threading
+import zlib
+import numpy as np
 import utils
+from evaluator import HOLD, BUY, SELL, TRADETYPES, gold_to_regional
+from profiler import Stage
+
+
+HEADER = "time,market_price,prior_price,prediction,trade,tradeprice,volume,regionbank,wowbank,taper,runtime"
+
+# Column types of the columnar ("npy") output. Trade types are stored as their
+# evaluator codes.
+DTYPES = {"time": "datetime64[ns]",
+		"market_price": np.float64,
+		"prior_price": np.float64,
+		"prediction": np.float64,
+		"trade": np.int8,
+		"tradeprice": np.float64,
+		"volume": np.int64,
+		"regionbank": np.float64,
+		"wowbank": np.float64,
+		"taper": np.int64,
+		"runtime": np.float64}
+
+# One row of History
+RECORD_DTYPE = np.dtype(list(DTYPES.items()))
+
+# Run logs (mode="log") are a directory of compressed segments and their index
+SEGMENT = "{:05d}.seg"
+INDEX = "index"
+
+# One index entry per compressed block: the block's time range (epoch ns), where it
+# is and how many rows it holds
+INDEX_DTYPE = np.dtype([("start", "<i8"),
+						("end", "<i8"),
+						("segment", "<i4"),
+						("rows", "<i4"),
+						("offset", "<i8"),
+						("length", "<i8")])
+
+
+def _datetime64(time):
+	# Integer times are epoch seconds (binary price stores), anything else is parsed
+	if isinstance(time, (int, np.integer)):
+		return np.datetime64(int(time), "s")
+	return np.datetime64(time, "ns")
+
+
+def _text(time):
+	# Epoch seconds are written the way the price CSVs write their times
+	if isinstance(time, (int, np.integer)):
+		return str(np.datetime64(int(time), "s")).replace("T", " ")
+	return time
+
+
+class Summary:
+	'''
+	Statistics of a run, as returned by Stats.summary(). Values are in regional
+	currency and runtimes in seconds.
+	'''
+	FIELDS = ("ticks", "start_value", "final_value", "return", "peak", "max_drawdown",
+			"buys", "sells", "holds", "volume", "round_trips", "wins", "win_rate",
+			"realized_pnl", "mean_pnl", "taper", "tapered_sells",
+			"runtime_total", "runtime_p50", "runtime_p90", "runtime_p99", "runtime_max")
+
+	def __init__(self, **values):
+		for name in self.FIELDS:
+			setattr(self, name, values.get(name))
+
+	def as_dict(self):
+		return {name: getattr(self, name) for name in self.FIELDS}
+
+	def __repr__(self):
+		return "\n".join(f"{name:<14} {getattr(self, name)}" for name in self.FIELDS)
+
+
+class Stats:
+	'''
+	Running statistics of a run, updated with every recorded row so nothing has to
+	be read back from the output afterwards.
+
+	Equity is the value of both accounts in regional currency at the row's market
+	price. A round trip is a buy and the sell that unwinds it. Its realized P&L is
+	the gold gained on the buy less the gold paid on the sell, valued at the sell
+	price, less the tokens given back for tapered units. Runtime percentiles come
+	from a power-of-two histogram (profiler.Stage), so they are bucket edges.
+
+	Only running values are kept, a fixed amount whatever the length of the run, so
+	get_state() is small enough to go into every checkpoint.
+	'''
+	def __init__(self, token):
+		self.token = token
+		self.ticks = 0
+		self.start_value = None
+		self.final_value = None
+		self.peak = None
+		self.max_drawdown = 0.0
+		self.counts = [0, 0, 0]
+		self.volume = 0
+		self.taper = 0
+		self.tapered_sells = 0
+		self.round_trips = 0
+		self.wins = 0
+		self.realized_pnl = 0.0
+		self.runtime = Stage()
+		self._buy = None
+
+	def update(self, regionbank, wowbank, dcs, taper, runtime):
+		value = regionbank + gold_to_regional(wowbank, dcs.price/self.token)
+		if not self.ticks:
+			self.start_value = value
+		self.final_value = value
+		self.ticks += 1
+		if self.peak is None or value > self.peak:
+			self.peak = value
+		elif self.peak > 0:
+			drawdown = 1 - value/self.peak
+			if drawdown > self.max_drawdown:
+				self.max_drawdown = drawdown
+
+		code = dcs.code
+		self.counts[code] += 1
+		if code == BUY:
+			self.volume += dcs.volume
+			self._buy = (dcs.trade_price * dcs.volume, dcs.volume)
+		elif code == SELL:
+			self.taper += taper
+			if taper:
+				self.tapered_sells += 1
+			if self._buy is not None:
+				gold, volume = self._buy
+				pnl = (gold_to_regional(gold - dcs.trade_price * dcs.volume, dcs.price/self.token)
+						- self.token * (volume - dcs.volume))
+				self.realized_pnl += pnl
+				self.round_trips += 1
+				if pnl > 0:
+					self.wins += 1
+				self._buy = None
+
+		self.runtime.add(int(runtime * 1e9))
+
+	def get_state(self):
+		'''
+		The running values as plain lists and numbers, e.g. for a checkpoint
+		'''
+		rt = self.runtime
+		return {"ticks": self.ticks,
+				"start_value": self.start_value,
+				"final_value": self.final_value,
+				"peak": self.peak,
+				"max_drawdown": self.max_drawdown,
+				"counts": list(self.counts),
+				"volume": self.volume,
+				"taper": self.taper,
+				"tapered_sells": self.tapered_sells,
+				"round_trips": self.round_trips,
+				"wins": self.wins,
+				"realized_pnl": self.realized_pnl,
+				"runtime": [rt.count, rt.total, rt.min, rt.max, list(rt.histogram)],
+				"buy": None if self._buy is None else list(self._buy)}
+
+	def set_state(self, state):
+		'''
+		Restore what get_state() returned, to carry on from those rows
+		'''
+		for name in ("ticks", "start_value", "final_value", "peak", "max_drawdown", "volume", "taper",
+					"tapered_sells", "round_trips", "wins", "realized_pnl"):
+			setattr(self, name, state[name])
+		self.counts = list(state["counts"])
+		rt = self.runtime
+		rt.count, rt.total, rt.min, rt.max, histogram = state["runtime"]
+		rt.histogram = list(histogram)
+		self._buy = None if state["buy"] is None else tuple(state["buy"])
+
+	def summary(self):
+		n = self.ticks
+		start = self.start_value
+		final = self.final_value
+		rt = self.runtime
+		percentile = lambda q: rt.percentile(q) / 1e9 if rt.count else None
+		return Summary(ticks=n,
+					start_value=start,
+					final_value=final,
+					peak=self.peak,
+					max_drawdown=self.max_drawdown,
+					buys=self.counts[BUY],
+					sells=self.counts[SELL],
+					holds=self.counts[HOLD],
+					volume=self.volume,
+					round_trips=self.round_trips,
+					wins=self.wins,
+					win_rate=self.wins / self.round_trips if self.round_trips else None,
+					realized_pnl=self.realized_pnl,
+					mean_pnl=self.realized_pnl / self.round_trips if self.round_trips else None,
+					taper=self.taper,
+					tapered_sells=self.tapered_sells,
+					runtime_total=rt.total / 1e9,
+					runtime_p50=percentile(50),
+					runtime_p90=percentile(90),
+					runtime_p99=percentile(99),
+					runtime_max=rt.max / 1e9 if rt.count else None,
+					**{"return": final/start - 1 if n and start else None})
+
 
 class Batch:
-	def __init__(self, fn, size=500, dirpath=""):
+	'''
+	Buffers recorded rows and appends them to fn in batches of 'size'.
+
+	mode="csv" writes the original comma separated text file.
+
+	mode="npy" keeps each column in a preallocated typed buffer. Full batches are
+	handed to a background thread that appends them to fn as one .npy array per column,
+	so record() doesn't wait on the disk. 'buffers' sets how many batches can be in
+	flight; record() only blocks when all of them are still waiting to be written.
+	Read the output back with recorder.load. Call close() at the end of a run to write
+	the last partial batch.
+
+	mode="log" buffers and writes in the background like "npy", but fn is a
+	directory of compressed segments with a time index (see LogWriter), read back
+	with LogReader. A new segment is started once one grows past 'segment_size'
+	bytes.
+
+	position: resume an existing output instead of starting a new one. Anything
+	after byte 'position' (a Batch.position saved with a checkpoint) is cut off and
+	new rows are appended from there.
+
+	token: keep running Stats of the recorded rows, read with summary()
+	'''
+	def __init__(self, fn, size=500, dirpath="", mode="csv", buffers=2, position=None, token=None,
+				segment_size=1 << 26):
 		if os.path.isdir(dirpath):
 			self.dirpath = dirpath
 		else:
@@ -11,37 +238,100 @@ class Batch:
 			else:
 				self.dirpath = self._adjudicate_nearest_path(dirpath)
 
+		if mode not in ("csv", "npy", "log"):
+			raise ValueError(f"Unknown output mode {mode}")
+
 		self._fn = fn
 		self._size = size
+		self.mode = mode
 		self.batch = []
 		self._fp = f"{self.dirpath}/{self._fn}"
+		self._segment_size = segment_size
+		self.stats = None if token is None else Stats(token)
+
+		self._initialize_file(position)
+
+		if self.mode in ("npy", "log"):
+			self._n = 0
+			self._free = queue.Queue()
+			for i in range(buffers):
+				self._free.put(self._allocate())
+			self._columns = self._free.get()
 
-		self._initialize_file()
+			self._pending = queue.Queue()
+			self._error = None
+			self._writer = threading.Thread(target=self._write_loop, daemon=True)
+			self._writer.start()
+
+	def _initialize_file(self, position=None):
+		if self.mode == "log":
+			LogWriter.reset(self._fp, position)
+			return
+
+		if position is not None:
+			with open(self._fp, "r+b") as f:
+				f.truncate(position)
+			return
+
+		if self.mode == "npy":
+			open(self._fp, "wb").close()
+			return
 
-	def _initialize_file(self):
 		with open(self._fp, "w") as f:
-			line = "time,market_price,prior_price,prediction,trade,tradeprice,volume,regionbank,wowbank,taper,runtime"
+			line = HEADER
 			f.write(line)
 
 	def _adjudicate_nearest_path(self, dirpath):
 		curdir = utils.Path.cwd()
-		pf = utils.PathFinder()
+		pf = utils.PathResolver()
 		loc = pf.search(dirpath, filepath=True)
 		if loc is None:
 			raise utils.PathError(f"{dirpath} not found within {pf.depth_max} recursions")
 		return loc
 
+	def _allocate(self):
+		return {name: np.empty(self._size, dtype=dtype) for name, dtype in DTYPES.items()}
+
 	def record(self, time, regionbank, wowbank, dcs, taper, runtime):
+		if self.stats is not None:
+			self.stats.update(regionbank.value, wowbank.value, dcs, taper, runtime)
+		if self.mode != "csv":
+			self._record_columns(time, regionbank, wowbank, dcs, taper, runtime)
+			return
+
 		array = list(dcs.array)
 		array.extend([regionbank.value, wowbank.value, taper, runtime])
-		array.insert(0,time)
+		array.insert(0,_text(time))
 
 		self.batch.append(array)
 
 		if len(self.batch) == self._size:
 			self.store()
 
+	def _record_columns(self, time, regionbank, wowbank, dcs, taper, runtime):
+		i = self._n
+		c = self._columns
+		c["time"][i] = _datetime64(time)
+		c["market_price"][i] = dcs.price
+		c["prior_price"][i] = dcs.price_lag1
+		c["prediction"][i] = dcs.prediction
+		c["trade"][i] = dcs.code
+		c["tradeprice"][i] = dcs.trade_price
+		c["volume"][i] = dcs.volume
+		c["regionbank"][i] = regionbank.value
+		c["wowbank"][i] = wowbank.value
+		c["taper"][i] = taper
+		c["runtime"][i] = runtime
+		self._n = i + 1
+
+		if self._n == self._size:
+			self.store()
+
 	def store(self):
+		if self.mode != "csv":
+			self._store_columns()
+			return
+
 		out = "\n" + "\n".join([",".join([str(x) for x in array]) for array in self.batch])
 		'''
 		'out' should go from
@@ -63,4 +353,339 @@ class Batch:
 
 		self.batch = []
 
+	def _store_columns(self):
+		self._raise_writer_error()
+		if self._n == 0:
+			return
+		# Hand the filled buffers to the writer and continue in a free set
+		self._pending.put((self._columns, self._n))
+		self._columns = self._free.get()
+		self._n = 0
+
+	def _write_loop(self):
+		if self.mode == "log":
+			sink = LogWriter(self._fp, segment_size=self._segment_size)
+		else:
+			sink = open(self._fp, "ab")
+		with sink as f:
+			while True:
+				item = self._pending.get()
+				if item is None:
+					break
+				columns, n = item
+				try:
+					if self._error is None:
+						self._write_columns(f, columns, n)
+				except Exception as e:
+					self._error = e
+				self._free.put(columns)
+				self._pending.task_done()
+
+	def _write_columns(self, f, columns, n):
+		if self.mode == "log":
+			rows = np.empty(n, dtype=RECORD_DTYPE)
+			for name in DTYPES:
+				rows[name] = columns[name][:n]
+			f.append(rows)
+			return
+
+		for name in DTYPES:
+			np.save(f, columns[name][:n])
+		f.flush()
+
+	def _raise_writer_error(self):
+		if self._error is not None:
+			raise RuntimeError(f"Writing {self._fp} failed: {self._error}")
+
+	def flush(self):
+		'''
+		Store the buffered rows and, in npy and log mode, wait until they are on disk
+		'''
+		if self.mode != "csv":
+			self._store_columns()
+			self._pending.join()
+			self._raise_writer_error()
+		elif self.batch:
+			self.store()
+
+	@property
+	def position(self):
+		'''
+		Size of the output once flushed. Everything before it is complete rows. In log
+		mode it is the size of the index.
+		'''
+		if self.mode == "log":
+			return os.path.getsize(os.path.join(self._fp, INDEX))
+		return os.path.getsize(self._fp)
+
+	def close(self):
+		'''
+		Store the remaining rows and, in npy and log mode, wait for the writer to finish
+		'''
+		if self.mode != "csv":
+			self._store_columns()
+			self._pending.put(None)
+			self._writer.join()
+			self._raise_writer_error()
+		elif self.batch:
+			self.store()
+
+	def summary(self):
+		return None if self.stats is None else self.stats.summary()
+
+
+class History:
+	'''
+	In-memory record of a run. Every tick is written by index into a preallocated
+	structured array (RECORD_DTYPE, a fixed number of bytes per row) that doubles
+	in size when it fills up. It has the same record()/close() interface as Batch,
+	so it can be passed to algo.algo as 'records'.
+	'''
+	def __init__(self, capacity=1 << 16, token=None):
+		self._rows = np.zeros(capacity, dtype=RECORD_DTYPE)
+		self.n = 0
+		self.stats = None if token is None else Stats(token)
+
+	def record(self, time, regionbank, wowbank, dcs, taper, runtime):
+		if self.stats is not None:
+			self.stats.update(regionbank.value, wowbank.value, dcs, taper, runtime)
+		i = self.n
+		if i == len(self._rows):
+			self._rows = np.concatenate((self._rows, np.zeros(len(self._rows), dtype=RECORD_DTYPE)))
+
+		self._rows[i] = (_datetime64(time), dcs.price, dcs.price_lag1, dcs.prediction, dcs.code,
+						dcs.trade_price, dcs.volume, regionbank.value, wowbank.value, taper, runtime)
+		self.n = i + 1
+
+	def close(self):
+		pass
+
+	def summary(self):
+		return None if self.stats is None else self.stats.summary()
+
+	@property
+	def rows(self):
+		return self._rows[:self.n]
+
+	def to_frame(self):
+		import pandas as pd
+
+		df = pd.DataFrame(self.rows).set_index("time")
+		df["trade"] = pd.Categorical.from_codes(df["trade"], TRADETYPES)
+		return df
+
+
+def load(fp):
+	'''
+	Read a Batch file written in npy mode into a DataFrame
+	'''
+	import pandas as pd
+
+	chunks = {name: [] for name in DTYPES}
+	with open(fp, "rb") as f:
+		size = os.fstat(f.fileno()).st_size
+		while f.tell() < size:
+			for name in DTYPES:
+				chunks[name].append(np.load(f))
+
+	columns = {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=DTYPES[name])
+				for name, arrays in chunks.items()}
+	df = pd.DataFrame(columns).set_index("time")
+	df["trade"] = pd.Categorical.from_codes(df["trade"], TRADETYPES)
+	return df
+
+
+def _ns(time):
+	# A time bound as epoch nanoseconds, parsed like recorded times
+	return int(_datetime64(time).astype("datetime64[ns]").astype(np.int64))
+
+
+def _read_index(fp):
+	# Every complete entry of a log's index. A reader can catch the writer halfway
+	# through an entry, so a trailing partial entry is left out.
+	try:
+		with open(os.path.join(fp, INDEX), "rb") as f:
+			data = f.read()
+	except FileNotFoundError:
+		return np.empty(0, dtype=INDEX_DTYPE)
+	n = len(data) // INDEX_DTYPE.itemsize
+	return np.frombuffer(data, dtype=INDEX_DTYPE, count=n)
+
+
+class LogWriter:
+	'''
+	Writes a run log: a directory of segment files and an index.
+
+	Rows are appended in blocks (RECORD_DTYPE rows compressed with zlib). Each block
+	gets an index entry (INDEX_DTYPE) with its time range, segment, byte offset and
+	length, so a reader can go straight to the blocks of a time window. Once a
+	segment passes 'segment_size' bytes the next block starts a new one.
+
+	A block is written out before its index entry, and both files are only ever
+	appended to, so readers can query the log while it is being written. They see
+	every block up to the last complete index entry.
+	'''
+	def __init__(self, fp, segment_size=1 << 26, level=6):
+		self.fp = fp
+		self.segment_size = segment_size
+		self.level = level
+
+		entries = _read_index(fp)
+		if len(entries):
+			last = entries[-1]
+			self.segment = int(last["segment"])
+			self.offset = int(last["offset"] + last["length"])
+		else:
+			self.segment = 0
+			self.offset = 0
+		self._index = open(os.path.join(fp, INDEX), "ab")
+		self._file = open(self._segment_path(self.segment), "ab")
+
+	def _segment_path(self, segment):
+		return os.path.join(self.fp, SEGMENT.format(segment))
+
+	@classmethod
+	def reset(cls, fp, position=None):
+		'''
+		Start a new log at fp, or with 'position' cut an existing one back to its
+		first position/INDEX_DTYPE.itemsize blocks
+		'''
+		os.makedirs(fp, exist_ok=True)
+		if position is None:
+			for name in os.listdir(fp):
+				if name == INDEX or name.endswith(".seg"):
+					os.remove(os.path.join(fp, name))
+			open(os.path.join(fp, INDEX), "wb").close()
+			return
+
+		with open(os.path.join(fp, INDEX), "r+b") as f:
+			f.truncate(position)
+		entries = _read_index(fp)
+		segment, end = 0, 0
+		if len(entries):
+			segment = int(entries[-1]["segment"])
+			end = int(entries[-1]["offset"] + entries[-1]["length"])
+		for name in os.listdir(fp):
+			if name.endswith(".seg") and int(name.split(".")[0]) > segment:
+				os.remove(os.path.join(fp, name))
+		with open(os.path.join(fp, SEGMENT.format(segment)), "ab") as f:
+			f.truncate(end)
+
+	def append(self, rows):
+		if not len(rows):
+			return
+		if self.offset >= self.segment_size:
+			self._file.close()
+			self.segment += 1
+			self.offset = 0
+			self._file = open(self._segment_path(self.segment), "ab")
+
+		data = zlib.compress(rows.tobytes(), self.level)
+		self._file.write(data)
+		self._file.flush()
+
+		time = rows["time"].view(np.int64)
+		entry = np.array([(time.min(), time.max(), self.segment, len(rows), self.offset, len(data))],
+						dtype=INDEX_DTYPE)
+		self._index.write(entry.tobytes())
+		self._index.flush()
+		self.offset += len(data)
+
+	def close(self):
+		self._file.close()
+		self._index.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class LogReader:
+	'''
+	Time window queries on a run log (LogWriter, Batch mode="log").
+
+	Every query reads the index afresh, so it sees what a running writer has written
+	so far. Only blocks whose time range overlaps the window are read and
+	decompressed. Any number of readers can use a log at once.
+	'''
+	def __init__(self, fp):
+		self.fp = fp
+		self._files = {}
+
+	def _segment(self, segment):
+		if segment not in self._files:
+			self._files[segment] = open(os.path.join(self.fp, SEGMENT.format(segment)), "rb")
+		return self._files[segment]
+
+	def index(self):
+		return _read_index(self.fp)
+
+	def _block(self, entry):
+		f = self._segment(int(entry["segment"]))
+		f.seek(int(entry["offset"]))
+		data = f.read(int(entry["length"]))
+		if len(data) < entry["length"]:
+			raise zlib.error("block cut short")
+		return np.frombuffer(zlib.decompress(data), dtype=RECORD_DTYPE)
+
+	def rows(self, start=None, end=None, retries=3):
+		'''
+		Rows with start <= time < end as a RECORD_DTYPE array. Times are anything
+		np.datetime64 parses, or epoch seconds; None leaves that side open.
+
+		A run resumed from a checkpoint cuts its log back before writing again, which
+		can pull blocks from under a query. The query then starts over from the
+		index, up to 'retries' times.
+		'''
+		start = None if start is None else _ns(start)
+		end = None if end is None else _ns(end)
+		for attempt in range(retries + 1):
+			try:
+				return self._rows(start, end)
+			except zlib.error:
+				if attempt == retries:
+					raise
+				self.close()
+
+	def _rows(self, start, end):
+		entries = self.index()
+		keep = np.ones(len(entries), dtype=bool)
+		if start is not None:
+			keep &= entries["end"] >= start
+		if end is not None:
+			keep &= entries["start"] < end
+
+		blocks = []
+		for entry in entries[keep]:
+			rows = self._block(entry)
+			time = rows["time"].view(np.int64)
+			mask = np.ones(len(rows), dtype=bool)
+			if start is not None:
+				mask &= time >= start
+			if end is not None:
+				mask &= time < end
+			blocks.append(rows[mask])
+		return np.concatenate(blocks) if blocks else np.empty(0, dtype=RECORD_DTYPE)
+
+	def read(self, start=None, end=None):
+		'''
+		rows() as a DataFrame indexed by time, like History.to_frame
+		'''
+		import pandas as pd
+
+		df = pd.DataFrame(self.rows(start, end)).set_index("time")
+		df["trade"] = pd.Categorical.from_codes(df["trade"], TRADETYPES)
+		return df
+
+	def close(self):
+		for f in self._files.values():
+			f.close()
+		self._files = {}
+
+	def __enter__(self):
+		return self
 
+	def __exit__(self, *exc):
+		self.close()
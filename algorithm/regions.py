@@ -0,0 +1,126 @@
+'''
+Multi-region backtests.
+
+Runs algo.algo over every region's price file at the same time, one worker process
+per region. Each region has its own accounts and writes its own recorder output
+(<region>-<outfile>), and the per-region results are merged into one summary table.
+'''
+
+import glob
+import os
+import time as _time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import algo
+import engine
+import evaluator
+import utils
+
+SUFFIX = "-token-full.csv"
+
+# Columns of the summary table
+COLUMNS = ["region", "start_value", "final_value", "return", "seconds", "error"]
+
+
+def find_files(dirpath="data"):
+	'''
+	Region price files in the data directory, by region name. Paths are absolute,
+	since algo.algo changes the working directory of the process it runs in.
+	'''
+	if not os.path.isdir(dirpath):
+		dirpath = utils.PathResolver().search(dirpath, filepath=True)
+		if dirpath is None:
+			raise utils.PathError("data directory not found")
+
+	dirpath = os.path.abspath(dirpath)
+	files = sorted(glob.glob(os.path.join(dirpath, f"*{SUFFIX}")))
+	return {os.path.basename(fp)[:-len(SUFFIX)].upper(): fp for fp in files}
+
+
+def _setting(value, region):
+	# Settings can be given once for every region or as a dict by region
+	return value[region] if isinstance(value, dict) else value
+
+
+def _first_price(fp, warmup=engine.WARMUP):
+	# Price of the first tick algo.algo trades on, after its warm-up
+	for time, price, pdelta in algo.read_blocks(fp):
+		if len(price) > warmup:
+			return float(price[warmup])
+		warmup -= len(price)
+	raise ValueError(f"{fp} has no prices after the warm-up")
+
+
+def run_region(fp, region, start_regional, start_gold, token, outfile, mode):
+	start = _time.perf_counter()
+	os.chdir(os.path.dirname(fp))
+	value = algo.algo(file=os.path.basename(fp),
+					start_regional=start_regional,
+					region=region,
+					start_gold=start_gold,
+					token=token,
+					outfile=f"{region.lower()}-{outfile}",
+					mode=mode)
+
+	# Both accounts in regional currency at the first traded price
+	start_value = start_regional + evaluator.gold_to_regional(start_gold, _first_price(fp)/token)
+	return {"region": region,
+			"start_value": start_value,
+			"final_value": value,
+			"return": value/start_value - 1,
+			"seconds": _time.perf_counter() - start}
+
+
+def run(start_regional, start_gold, token, outfile="testrun.txt", mode="csv", regions=None, workers=None):
+	'''
+	start_regional, start_gold, token: a value for every region, or a dict by region
+	regions: region names to run, defaults to every region file found
+
+	Returns a DataFrame with one row per region. Regions that fail have their error
+	in the 'error' column.
+	'''
+	files = find_files()
+	if regions is not None:
+		files = {region: files[region.upper()] for region in regions}
+
+	jobs = {}
+	rows = []
+	with ProcessPoolExecutor(max_workers=workers or len(files) or None) as pool:
+		for region, fp in files.items():
+			jobs[region] = pool.submit(run_region, fp, region,
+									_setting(start_regional, region),
+									_setting(start_gold, region),
+									_setting(token, region),
+									outfile, mode)
+
+		for region, job in jobs.items():
+			try:
+				row = job.result()
+				row["error"] = None
+			except Exception as e:
+				row = {"region": region, "error": f"{type(e).__name__}: {e}"}
+			rows.append(row)
+
+	return summarize(pd.DataFrame(rows))
+
+
+def summarize(table):
+	'''
+	Add a total row over every region that finished. Values are in each region's own
+	currency, so the total has no start or final value, only the mean of the region
+	returns.
+	'''
+	# A table of failed regions only, or of none, still has every column
+	table = table.reindex(columns=COLUMNS)
+	done = table[table["error"].isna()]
+	total = {"region": "ALL",
+			"return": done["return"].mean(),
+			"seconds": done["seconds"].max(),
+			"error": None}
+	return pd.concat([table, pd.DataFrame([total], columns=COLUMNS)], ignore_index=True)
+
+
+if __name__ == '__main__':
+	print(run(start_regional=1000,
+			start_gold=200000,
+			token=20).to_string(index=False))
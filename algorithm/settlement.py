@@ -0,0 +1,125 @@
+'''
+Settlement of trades between the regional and WoW accounts.
+
+A buy moves token*volume regional into tprice*volume gold. A sell moves it back,
+then any gold beyond one token's worth is swept back to regional.
+
+When the WoW account can't cover a sale, the volume is tapered down to the largest
+volume it can cover, and one token per unit dropped is given back to regional. This
+used to be found by lowering the volume one unit at a time. The cost of selling v
+units, sell_price(mp, v)*v, only grows with v, so the largest affordable volume is
+found directly instead: a logarithmic estimate, then an integer search around it
+with the same float expression the unit loop used. That makes the volume, trade
+price and balances identical to the loop's, in O(log volume) steps.
+
+The functions work on plain numbers so engine.simulate can use them on its float
+balances. settle() applies them to a Decision and accounts.Account objects.
+'''
+
+from math import log
+import evaluator
+
+
+def _cost(price, v):
+	return evaluator.Opt.sell_price(price, v) * v
+
+
+def _estimate(price, gold):
+	# Solve v*(1+cr)^v = gold/price, i.e. log(v) + v*log(1+cr) = log(gold/price),
+	# with one Newton step from v = gold/price (the answer for cr = 0)
+	v = gold / price
+	if v <= 1:
+		return 0
+	k = log(1 + evaluator.Opt.cr)
+	v -= (log(v) + v*k - log(gold/price)) / (1/v + k)
+	return int(v)
+
+
+def affordable(price, volume, gold):
+	'''
+	Largest volume below 'volume' whose sale at 'price' costs no more than 'gold'.
+	Same as lowering 'volume' one unit at a time until the sale is covered.
+	'''
+	if volume <= 0:
+		return 0
+
+	# Find lo < hi with cost(lo) <= gold < cost(hi), widening around the estimate.
+	# cost(0) is 0, and 'volume' itself is taken as uncovered.
+	guess = min(max(_estimate(price, gold), 0), volume - 1)
+	step = 1
+	if _cost(price, guess) <= gold:
+		lo, hi = guess, min(guess + step, volume)
+		while hi < volume and _cost(price, hi) <= gold:
+			lo, step = hi, step*2
+			hi = min(lo + step, volume)
+	else:
+		lo, hi = max(guess - step, 0), guess
+		while lo > 0 and _cost(price, lo) > gold:
+			hi, step = lo, step*2
+			lo = max(hi - step, 0)
+
+	while hi - lo > 1:
+		mid = (lo + hi) // 2
+		if _cost(price, mid) <= gold:
+			lo = mid
+		else:
+			hi = mid
+	return lo
+
+
+def buy(volume, trade_price, token, regional, gold):
+	'''
+	Returns the balances after the buy. Raises RuntimeError if regional can't pay.
+	'''
+	cost = token * volume
+	if cost > regional:
+		raise RuntimeError(f"Tried to withdraw {cost} from an account valued at {regional}")
+	return regional - cost, gold + trade_price * volume
+
+
+def sell(price, volume, trade_price, token, regional, gold):
+	'''
+	Returns (regional, gold, volume, trade_price, taper) after the sale. 'taper' is
+	the number of units dropped because the WoW account couldn't cover them all.
+	'''
+	regional += token * volume
+	cost = trade_price * volume
+	taper = 0
+	if cost > gold:
+		v = affordable(price, volume, gold)
+		taper = volume - v
+		volume = v
+		trade_price = evaluator.Opt.sell_price(price, volume)
+		cost = trade_price * volume
+		regional -= token * taper
+	return regional, gold - cost, volume, trade_price, taper
+
+
+def sweep(price, token, regional, gold):
+	'''
+	Move profits to regional, keeping at most one token's worth of gold
+	'''
+	if gold > price:
+		q = int(gold/price) - 1
+		regional += token*q
+		gold -= q*price
+	return regional, gold
+
+
+def settle(dcs, price, token, regionbank, wowbank):
+	'''
+	Move the currencies of a decision between the regional and WoW accounts.
+	dcs.volume and dcs.trade_price are lowered if a sale can't be covered.
+	Returns the taper.
+	'''
+	taper = 0
+	if dcs.code == evaluator.BUY:
+		regionbank.withdraw(token * dcs.volume)
+		wowbank.deposit(dcs.trade_price * dcs.volume)
+
+	elif dcs.code == evaluator.SELL:
+		regional, gold, dcs.volume, dcs.trade_price, taper = sell(price, dcs.volume, dcs.trade_price, token,
+																	regionbank.value, wowbank.value)
+		regionbank.value, wowbank.value = sweep(price, token, regional, gold)
+
+	return taper
@@ -0,0 +1,133 @@
+'''
+Parallel parameter sweeps.
+
+Runs engine.backtest for every combination in a parameter grid over a process pool.
+The price series is read once in the parent and placed in shared memory. Workers map
+it as a read-only array when they start, so tasks only carry their configuration.
+
+Parameters that can be swept:
+	cr 				:: 	Opt compound rate
+	token 			:: 	token price in regional currency
+	start_regional 	:: 	starting regional balance
+	start_gold 		:: 	starting gold balance
+	ar_params 		:: 	ARIMA AR coefficients
+	ma_params 		:: 	ARIMA MA coefficients
+'''
+
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import algo
+import engine
+import evaluator
+from model import ARIMA
+
+
+DEFAULTS = {"cr": evaluator.Opt.cr,
+			"token": 20,
+			"start_regional": 1000,
+			"start_gold": 200000,
+			"ar_params": None,
+			"ma_params": None}
+
+# Worker side view of the shared price series
+_shm = None
+_price = None
+
+
+def grid(params):
+	'''
+	params: dict of parameter name -> list of values
+
+	Returns one configuration dict per combination. Parameters that aren't given
+	keep their DEFAULTS value.
+	'''
+	unknown = set(params) - set(DEFAULTS)
+	if unknown:
+		raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+	keys = list(params)
+	return [dict(DEFAULTS, **dict(zip(keys, values))) for values in itertools.product(*params.values())]
+
+
+def summarize(result, token):
+	'''
+	Final balances and trade statistics of an engine.backtest result
+	'''
+	last = result.iloc[-1]
+	trade = result["trade"]
+	return {"final_value": engine.final_value(result, token),
+			"regionbank": last.regionbank,
+			"wowbank": last.wowbank,
+			"buys": int((trade == "buy").sum()),
+			"sells": int((trade == "sell").sum()),
+			"volume": int(result["volume"][trade == "buy"].sum()),
+			"taper": int(result["taper"].sum())}
+
+
+def run_config(config, price):
+	cr = evaluator.Opt.cr
+	evaluator.Opt.cr = config["cr"]
+	try:
+		kwargs = {k: config[k] for k in ("ar_params", "ma_params") if config[k] is not None}
+		result = engine.backtest(price,
+								start_regional=config["start_regional"],
+								start_gold=config["start_gold"],
+								token=config["token"],
+								model=ARIMA(**kwargs))
+		row = summarize(result, config["token"])
+		row["error"] = None
+	except Exception as e:
+		# One broken configuration (e.g. an account overdrawn) shouldn't end the sweep
+		row = {"error": f"{type(e).__name__}: {e}"}
+	finally:
+		evaluator.Opt.cr = cr
+
+	return dict(config, **row)
+
+
+def _attach(name, length):
+	global _shm, _price
+	_shm = shared_memory.SharedMemory(name=name)
+	_price = np.ndarray((length,), dtype=float, buffer=_shm.buf)
+	_price.flags.writeable = False
+
+
+def _run_shared(config):
+	return run_config(config, _price)
+
+
+def sweep(file, params, workers=None, chunksize=1):
+	'''
+	file: price file, found the same way algo.get_data finds it
+	params: dict of parameter name -> list of values (see grid)
+	workers: number of processes, defaults to the number of CPUs
+
+	Returns a DataFrame with one row per configuration.
+	'''
+	configs = grid(params)
+	time, price = algo.get_series(file)
+
+	shm = shared_memory.SharedMemory(create=True, size=max(price.nbytes, 1))
+	try:
+		shared = np.ndarray(price.shape, dtype=float, buffer=shm.buf)
+		shared[:] = price
+		del shared
+
+		with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(shm.name, len(price))) as pool:
+			rows = list(pool.map(_run_shared, configs, chunksize=chunksize))
+	finally:
+		shm.close()
+		shm.unlink()
+
+	return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+	table = sweep(file="eu-token-full.csv",
+				params={"cr": [0.000005, 0.00001, 0.00002],
+						"token": [15, 20, 25],
+						"start_regional": [1000, 5000]})
+	print(table.sort_values("final_value", ascending=False).to_string(index=False))
@@ -1,5 +1,5 @@
 from pathlib import Path
-import sys, os, time
+import sys, os, time, json, threading
 from contextlib import contextmanager
 
 
@@ -236,7 +236,7 @@ with redirect_stdout():
 @contextmanager
 def redirect_stdout():
 	import datetime
-	pf = PathFinder()
+	pf = PathResolver()
 	data_path = pf.search("data")
 	if data_path == None:
 		data_path = Path.cwd()
@@ -352,3 +352,136 @@ class PathFinder2:
 		cls.traversed	= set([])
 		cls.target		= None
 		cls.relative	= False
+
+
+# Resolved search targets shared by every PathResolver in the process
+_resolved	= {}
+_indexes	= {}
+_resolved_lock = threading.Lock()
+
+
+class PathResolver:
+	'''
+	Finds the directory containing 'target' the same way PathFinder does: first below
+	'start', then below each of its parents, up to 'recursion_depth' levels.
+
+	Directories are listed with os.scandir and searched breadth first, so the match
+	nearest to the starting directory wins and no stat call is made per entry.
+	Unreadable directories are skipped quietly.
+
+	Every resolved target is memoized for the rest of the process. If 'index' is a
+	file path, resolutions are also kept in that JSON file and reused by later
+	processes. Cached entries are checked to still exist before they are returned.
+
+	All search state is local to a call, so one resolver can be shared by threads.
+	'''
+	def __init__(self, delimiter="/", recursion_depth=7, index=None):
+		self.delimiter	= delimiter
+		self.depth_max	= recursion_depth
+		self.index		= index
+
+	def _target_check(self, target):
+		# Drop slashes at the beginning and end
+		return target.strip(self.delimiter)
+
+	def _key(self, target, start):
+		return f"{self.depth_max}{self.delimiter}{start}{self.delimiter}{self.delimiter}{target}"
+
+	def _load_index(self):
+		# Called with _resolved_lock held
+		if self.index not in _indexes:
+			try:
+				with open(self.index, "r") as f:
+					_indexes[self.index] = json.load(f)
+			except (OSError, ValueError):
+				_indexes[self.index] = {}
+		return _indexes[self.index]
+
+	def _save_index(self, entries):
+		tmp = f"{self.index}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(tmp, "w") as f:
+			json.dump(entries, f)
+		os.replace(tmp, self.index)
+
+	def _cached(self, key, target):
+		with _resolved_lock:
+			tpath = _resolved.get(key)
+			if tpath is None and self.index is not None:
+				tpath = self._load_index().get(key)
+		if tpath is not None and os.path.exists(f"{tpath}{self.delimiter}{target}"):
+			return tpath
+		return None
+
+	def _remember(self, key, tpath):
+		with _resolved_lock:
+			_resolved[key] = tpath
+			if self.index is not None:
+				entries = self._load_index()
+				entries[key] = tpath
+				self._save_index(entries)
+
+	def _walk(self, root, depth, target, relative, traversed):
+		level = [root]
+		while level:
+			below = []
+			for directory in level:
+				if directory in traversed:
+					continue
+				traversed.add(directory)
+
+				if relative and os.path.exists(f"{directory}{self.delimiter}{target}"):
+					return directory
+
+				try:
+					with os.scandir(directory or self.delimiter) as it:
+						entries = list(it)
+				except OSError:
+					continue
+
+				if not relative and any(entry.name == target for entry in entries):
+					return directory
+
+				if depth < self.depth_max:
+					for entry in entries:
+						try:
+							if entry.is_dir():
+								below.append(f"{directory}{self.delimiter}{entry.name}")
+						except OSError:
+							pass
+			level = below
+			depth += 1
+		return None
+
+	def search(self, target, start=None, filepath=False):
+		start = str(Path.cwd() if start is None else start)
+		# For formatting purposes, there cannot be a delimiter at the end
+		if len(start) > 1 and start[-1] == self.delimiter:
+			start = start[:-1]
+		target = self._target_check(target)
+		key = self._key(target, start)
+
+		tpath = self._cached(key, target)
+		if tpath is None:
+			relative = self.delimiter in target
+			traversed = set()
+
+			tpath = self._walk(start, 0, target, relative, traversed)
+			directory = start
+			depth = 0
+			while tpath is None and depth < self.depth_max:
+				parent = self.delimiter.join(directory.split(self.delimiter)[:-1])
+				if parent == directory:
+					break
+				depth += 1
+				tpath = self._walk(parent, depth, target, relative, traversed)
+				directory = parent
+
+			if tpath is None:
+				return None
+			self._remember(key, tpath)
+
+		# If filepath is True, return the absolute path to the target rather than to the
+		# directory that contains it
+		if filepath:
+			return f"{tpath}{self.delimiter}{target}"
+		return tpath
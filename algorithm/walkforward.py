@@ -0,0 +1,127 @@
+'''
+Walk-forward evaluation.
+
+The series is cut into consecutive test windows, each preceded by a training window.
+The ARIMA coefficients are fit on the training window and the strategy trades the
+test window that follows it, so every trade is out of sample.
+
+carry=True makes one pass over the series. A single ARIMA keeps its state across
+windows and only has its coefficients swapped at each boundary; each refit is warm
+started from the last one. Account balances and the last decision carry into the
+next window, so the windows chain into one continuous run.
+
+carry=False treats every window on its own: a fresh fit, fresh model state (warmed
+up on the training window) and the starting balances. The windows are then
+independent and run in parallel over a process pool.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import engine
+import evaluator
+import model as arima
+
+
+def windows(n, train, test):
+	'''
+	(train_start, test_start, test_end) of every test window in a series of length n.
+	Test windows are back to back; the last one may be shorter.
+	'''
+	return [(test_start - train, test_start, min(test_start + test, n))
+			for test_start in range(train, n, test)]
+
+
+def _value(regionbank, wowbank, price, token):
+	return regionbank + evaluator.gold_to_regional(wowbank, price/token)
+
+
+def _row(k, bounds, fit, result, start, end, price, token, time):
+	train_start, test_start, test_end = bounds
+	trade = result["trade"]
+	start_value = _value(start[0], start[1], price[test_start], token)
+	end_value = _value(end[0], end[1], price[test_end-1], token)
+	return {"window": k,
+			"train_start": train_start if time is None else time[train_start],
+			"test_start": test_start if time is None else time[test_start],
+			"test_end": test_end - 1 if time is None else time[test_end-1],
+			"sigma2": fit.sigma2,
+			"start_value": start_value,
+			"end_value": end_value,
+			"return": end_value/start_value - 1,
+			"buys": int((trade == "buy").sum()),
+			"sells": int((trade == "sell").sum()),
+			"volume": int(result["volume"][trade == "buy"].sum()),
+			"taper": int(result["taper"].sum())}
+
+
+def _warm(fit, train):
+	# Model state at the end of the training window. The first price only sets the
+	# starting level, so the first change the model sees is a real one.
+	model = fit.model()
+	model.prior_val = train[0]
+	model.filter(train[1:])
+	return model
+
+
+def _independent(k, bounds, train, test, start_regional, start_gold, token, p, q):
+	fit = arima.fit(train, p, q)
+	model = _warm(fit, train)
+	pred = model.filter(test)
+	result, end = engine.simulate(test, test + pred, start_regional, start_gold, token)
+	return k, fit, result, end
+
+
+def walk_forward(price, train, test, start_regional, start_gold, token, p=5, q=5,
+				carry=True, workers=None, time=None, maxiter=5):
+	'''
+	price: 1-D array of prices
+	train, test: window lengths in ticks
+	time: optional timestamps, used in place of indexes in the table
+	maxiter: Gauss-Newton iterations of the warm started refits (carry=True)
+
+	Returns a DataFrame with one row per test window.
+	'''
+	price = np.asarray(price, dtype=float)
+	bounds = windows(len(price), train, test)
+	rows = []
+
+	if carry:
+		fitter = arima.RollingFit(p=p, q=q, maxiter=maxiter)
+		model = None
+		state = (start_regional, start_gold, None)
+
+		for k, (train_start, test_start, test_end) in enumerate(bounds):
+			fit = fitter.update(price[train_start:test_start])
+			if model is None:
+				model = _warm(fit, price[train_start:test_start])
+			else:
+				# The model has already seen everything up to test_start
+				model.set_params(fit.ar_params, fit.ma_params)
+
+			test_prices = price[test_start:test_end]
+			pred = model.filter(test_prices)
+			result, end = engine.simulate(test_prices, test_prices + pred, state[0], state[1], token,
+										prior_dcs=state[2])
+			rows.append(_row(k, bounds[k], fit, result, state, end, price, token, time))
+			state = end
+	else:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			jobs = [pool.submit(_independent, k, (a, b, c), price[a:b], price[b:c],
+								start_regional, start_gold, token, p, q)
+					for k, (a, b, c) in enumerate(bounds)]
+			for job in jobs:
+				k, fit, result, end = job.result()
+				start = (start_regional, start_gold)
+				rows.append(_row(k, bounds[k], fit, result, start, end, price, token, time))
+
+	return pd.DataFrame(rows).set_index("window")
+
+
+if __name__ == '__main__':
+	import algo
+
+	time, price = algo.get_series("eu-token-full.csv")
+	table = walk_forward(price, train=3*24*30, test=3*24*7,
+						start_regional=1000, start_gold=200000, token=20, time=time)
+	print(table.to_string())
@@ -1,6 +1,25 @@
-import requests, json, datetime, os
+import requests, json, datetime, os, codecs, asyncio, random, tempfile
+from array import array
 from pathlib import Path
-import pandas as pd
+import numpy as np
+
+LINK = "https://wowtokenprices.com/history_prices_full.json"
+
+# Endpoints fetched by download_all, by name. Each serves a history document in
+# the format iter_records reads; regions found in several are merged by time.
+ENDPOINTS = {"history": LINK}
+
+# ETag and Last-Modified of every URL fetched, so unchanged data isn't sent again,
+# and the regions its document holds
+CACHE = "token-cache.json"
+
+# Statuses worth retrying
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Record layout of the binary price store, <region>-token.bin. Keep in sync with
+# algo.PRICE_DTYPE, which memory-maps these files.
+PRICE_DTYPE = np.dtype([("time", "<i8"), ("price", "<f8")])
+
 
 def connect_relative_dir(folder="", back=1):
 	# back is the number of previous directories we walk
@@ -19,7 +38,7 @@ def connect_relative_dir(folder="", back=1):
 		rel_path = f"{'../'*back}"
 
 	src_path = (mod_path / rel_path).resolve()
-	
+
 	if os.path.isdir(src_path):
 		os.chdir(src_path)
 	else:
@@ -27,18 +46,310 @@ def connect_relative_dir(folder="", back=1):
 		os.chdir(src_path)
 
 
-def download():
-	link = "https://wowtokenprices.com/history_prices_full.json"
-	content = requests.get(link).text
-	data_dict = eval(content)
-	
+def iter_records(chunks):
+	'''
+	Stream (region, time, price) out of the history JSON
+		{"<region>": [{"time": <epoch>, "price": <price>, ...}, ...], ...}
+	as it arrives. 'chunks' is any iterable of bytes or str pieces of the document.
+	Only one price entry is decoded at a time, so the document is never held whole.
+	'''
+	decoder = json.JSONDecoder()
+	utf8 = codecs.getincrementaldecoder("utf-8")()
+	buf = ""
+	pos = 0
+	state = "start"
+	region = None
+
+	def skip(buf, pos, chars=" \t\r\n"):
+		while pos < len(buf) and buf[pos] in chars:
+			pos += 1
+		return pos
+
+	for chunk in chunks:
+		buf = buf[pos:] + (utf8.decode(chunk) if isinstance(chunk, bytes) else chunk)
+		pos = 0
+
+		while True:
+			if state == "start":
+				pos = skip(buf, pos)
+				if pos == len(buf):
+					break
+				if buf[pos] != "{":
+					raise ValueError(f"Expected '{{' at the start of the document, got {buf[pos]!r}")
+				pos += 1
+				state = "key"
+
+			elif state == "key":
+				pos = skip(buf, pos, " \t\r\n,")
+				if pos == len(buf):
+					break
+				if buf[pos] == "}":
+					state = "done"
+					continue
+				# Region name, then ':' and the opening '[' of its price list
+				try:
+					key, end = decoder.raw_decode(buf, pos)
+				except json.JSONDecodeError:
+					break
+				end = skip(buf, end)
+				if end == len(buf):
+					break
+				if buf[end] != ":":
+					raise ValueError(f"Expected ':' after {key!r}")
+				end = skip(buf, end + 1)
+				if end == len(buf):
+					break
+				if buf[end] != "[":
+					raise ValueError(f"Expected a list of prices for {key!r}")
+				region = key
+				pos = end + 1
+				state = "items"
+
+			elif state == "items":
+				pos = skip(buf, pos, " \t\r\n,")
+				if pos == len(buf):
+					break
+				if buf[pos] == "]":
+					pos += 1
+					state = "key"
+					continue
+				try:
+					item, end = decoder.raw_decode(buf, pos)
+				except json.JSONDecodeError:
+					# The entry continues in the next chunk
+					break
+				pos = end
+				yield region, int(item['time']), float(item['price'])
+
+			else:
+				break
+
+	if state != "done":
+		raise ValueError("Price history ended before the document was complete")
+
+
+def store_path(region):
+	return f"{region}-token.bin"
+
+
+def csv_path(region):
+	return f"{region}-token-full.csv"
+
+
+def last_time(region):
+	'''
+	Latest timestamp in a region's binary store, or None if there is no store yet
+	'''
+	fp = store_path(region)
+	if not os.path.exists(fp) or os.path.getsize(fp) < PRICE_DTYPE.itemsize:
+		return None
+	store = np.memmap(fp, dtype=PRICE_DTYPE, mode="r")
+	return int(store["time"][-1])
+
+
+def stored(region):
+	'''
+	True if the region has both its binary store and a CSV with prices in them
+	'''
+	fp = csv_path(region)
+	return last_time(region) is not None and os.path.exists(fp) and os.path.getsize(fp) > 0
+
+
+def _format_price(price):
+	return int(price) if price.is_integer() else price
+
+
+def append(region, times, prices):
+	'''
+	Append new prices to the region's binary store and CSV. Unless both are there
+	(see stored) both files are written from scratch.
+	'''
+	fresh = not stored(region)
+	order = np.argsort(times, kind="stable")
+	records = np.empty(len(order), dtype=PRICE_DTYPE)
+	records["time"] = np.asarray(times)[order]
+	records["price"] = np.asarray(prices)[order]
+
+	with open(store_path(region), "wb" if fresh else "ab") as f:
+		records.tofile(f)
+
+	with open(csv_path(region), "w" if fresh else "a") as f:
+		if fresh:
+			f.write("time,price\n")
+		f.writelines(f"{datetime.datetime.fromtimestamp(t)},{_format_price(p)}\n"
+					for t, p in zip(records["time"].tolist(), records["price"].tolist()))
+
+
+def update(chunks):
+	'''
+	Store every price in 'chunks' that is newer than what is already stored for its
+	region. A region missing either of its files is stored from scratch. Returns the
+	number of new prices per region.
+	'''
+	last = {}
+	new = {}
+	for region, time, price in iter_records(chunks):
+		if region not in last:
+			last[region] = last_time(region) if stored(region) else None
+			new[region] = (array("q"), array("d"))
+		if last[region] is None or time > last[region]:
+			new[region][0].append(time)
+			new[region][1].append(price)
+
+	for region, (times, prices) in new.items():
+		if len(times):
+			append(region, times, prices)
+
+	return {region: len(times) for region, (times, prices) in new.items()}
+
+
+def download(link=LINK):
+	response = requests.get(link, stream=True)
+	response.raise_for_status()
+
 	connect_relative_dir(folder="", back=1)
-	data = {}
-	for region in data_dict.keys():
-		price = list(map(lambda x: x['price'], data_dict[region]))
-		time = list(map(lambda x: datetime.datetime.fromtimestamp(x['time']), data_dict[region]))
-		df = pd.DataFrame({"time": time, "price": price})
-		df.to_csv(f"{region}-token-full.csv", index=False)
+	try:
+		return update(response.iter_content(chunk_size=1 << 16))
+	finally:
+		response.close()
+
+def _load_cache(fp):
+	try:
+		with open(fp, "r") as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+
+def _save_cache(fp, cache):
+	tmp = f"{fp}.tmp"
+	with open(tmp, "w") as f:
+		json.dump(cache, f, indent=1)
+	os.replace(tmp, fp)
+
+
+def _chunks(f, size=1 << 16):
+	f.seek(0)
+	while True:
+		chunk = f.read(size)
+		if not chunk:
+			return
+		yield chunk
+
+
+def session(pool=8):
+	'''
+	requests.Session whose connection pool holds 'pool' connections per host, so
+	concurrent fetches reuse connections instead of opening new ones
+	'''
+	s = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+	s.mount("http://", adapter)
+	s.mount("https://", adapter)
+	return s
+
+
+def _get(s, url, validators, timeout):
+	# Blocking part of a fetch, run in a worker thread. The body is spooled to a
+	# temporary file, so documents aren't held in memory.
+	headers = {}
+	if validators.get("etag"):
+		headers["If-None-Match"] = validators["etag"]
+	if validators.get("last_modified"):
+		headers["If-Modified-Since"] = validators["last_modified"]
+
+	with s.get(url, headers=headers, stream=True, timeout=timeout) as response:
+		if response.status_code == 304:
+			return response.status_code, None, validators
+		if response.status_code in RETRY_STATUS:
+			return response.status_code, None, response.headers.get("Retry-After")
+		response.raise_for_status()
+
+		body = tempfile.TemporaryFile()
+		try:
+			for chunk in response.iter_content(chunk_size=1 << 16):
+				body.write(chunk)
+		except BaseException:
+			body.close()
+			raise
+		return response.status_code, body, {"etag": response.headers.get("ETag"),
+											"last_modified": response.headers.get("Last-Modified")}
+
+
+async def fetch(s, url, validators=None, retries=4, backoff=0.5, timeout=30):
+	'''
+	GET 'url' with a conditional request. Connection errors, timeouts and
+	RETRY_STATUS responses are retried up to 'retries' times, waiting
+	backoff*2^attempt seconds (with jitter, or the server's Retry-After).
+
+	Returns (body, validators): body is a temporary file holding the document, or
+	None if it hasn't changed since 'validators' were taken.
+	'''
+	validators = validators or {}
+	for attempt in range(retries + 1):
+		wait = backoff * 2**attempt * (0.5 + random.random())
+		try:
+			status, body, info = await asyncio.to_thread(_get, s, url, validators, timeout)
+		except (requests.ConnectionError, requests.Timeout):
+			if attempt == retries:
+				raise
+		else:
+			if status == 304:
+				return None, validators
+			if body is not None:
+				return body, info
+			if attempt == retries:
+				raise requests.HTTPError(f"{status} from {url} after {retries + 1} attempts")
+			if info is not None and info.isdigit():
+				wait = float(info)
+		await asyncio.sleep(wait)
+
+
+async def fetch_all(endpoints=ENDPOINTS, cache=CACHE, pool=8, retries=4, backoff=0.5, timeout=30):
+	'''
+	Fetch every endpoint concurrently over one pooled session and store the new
+	prices (see update). Documents are stored one at a time, as they arrive, so
+	endpoints sharing a region don't write its files at the same time.
+
+	Returns {name: {region: new prices}} with None for endpoints that hadn't changed.
+	A URL's validators are only sent while every region it returned is still stored,
+	so deleted files are downloaded again.
+	'''
+	validators = _load_cache(cache)
+	for url in list(validators):
+		regions = validators[url].get("regions")
+		if regions is None or not all(stored(region) for region in regions):
+			del validators[url]
+	lock = asyncio.Lock()
+	limit = asyncio.Semaphore(pool)
+	result = {}
+
+	with session(pool) as s:
+		async def one(name, url):
+			async with limit:
+				body, info = await fetch(s, url, validators.get(url), retries, backoff, timeout)
+			if body is None:
+				result[name] = None
+				return
+			with body:
+				async with lock:
+					result[name] = await asyncio.to_thread(update, _chunks(body))
+			info["regions"] = sorted(result[name])
+			validators[url] = info
+
+		try:
+			await asyncio.gather(*(one(name, url) for name, url in endpoints.items()))
+		finally:
+			# Keep the validators of everything stored, even if another fetch failed
+			_save_cache(cache, validators)
+
+	return result
+
+
+def download_all(endpoints=ENDPOINTS, **kwargs):
+	connect_relative_dir(folder="", back=1)
+	return asyncio.run(fetch_all(endpoints, **kwargs))
+
 
 if __name__ == '__main__':
-	download()
\ No newline at end of file
+	print(download_all())
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules import each other by bare name, as when run from their own directory
+for path in ("algorithm", os.path.join("data", "scripts")):
+	sys.path.insert(0, os.path.join(ROOT, path))
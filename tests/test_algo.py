@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import algo
+import engine
+import recorder
+
+
+def test_get_series_matches_get_data(tmp_path, monkeypatch):
+	n = 1000
+	price = np.round(150000 + np.cumsum(np.random.default_rng(0).normal(0, 800, n)))
+	time = pd.date_range("2018-01-01", periods=n, freq="20min")
+	pd.DataFrame({"time": time, "price": price}).to_csv(tmp_path / "test-token-full.csv", index=False)
+	monkeypatch.chdir(tmp_path)
+
+	rows = list(algo.get_data("test-token-full.csv"))
+	series_time, series_price = algo.get_series("test-token-full.csv")
+	assert series_time.dtype == np.int64
+	assert series_time.tolist() == [row[0] for row in rows]
+	assert series_price.tolist() == [row[1] for row in rows]
+	assert series_time[0] == time[1].value // 10**9
+
+
+def test_engine_matches_algo(tmp_path, monkeypatch):
+	dirpath = tmp_path / "data"
+	dirpath.mkdir()
+	n = 5000
+	rng = np.random.default_rng(1)
+	price = np.round(150000 + rng.normal(0, 3000, n) + np.cumsum(rng.normal(0, 400, n)))
+	time = pd.date_range("2018-01-01", periods=n, freq="20min")
+	pd.DataFrame({"time": time, "price": price}).to_csv(dirpath / "test-token-full.csv", index=False)
+	monkeypatch.chdir(tmp_path)
+
+	# Plenty of gold, and little gold so that sales get tapered
+	for start_regional, start_gold in ((1000, 200000), (50000, 100)):
+		records = recorder.History()
+		value = algo.algo(file="test-token-full.csv", start_regional=start_regional, region="EU",
+						start_gold=start_gold, token=20, outfile="unused.txt", records=records)
+		series_time, series_price = algo.get_series("test-token-full.csv")
+		result = engine.backtest(series_price, start_regional, start_gold, 20, time=series_time)
+		assert engine.final_value(result, 20) == value
+		rows = records.to_frame()
+		for name in ("prediction", "tradeprice", "volume", "regionbank", "wowbank", "taper"):
+			assert rows[name].tolist() == result[name].tolist(), name
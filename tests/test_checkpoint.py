@@ -0,0 +1,124 @@
+import os
+import threading
+from time import sleep
+import numpy as np
+import pandas as pd
+import pytest
+import algo
+import recorder
+
+FILE = "test-token-full.csv"
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+	# A price file in <tmp>/data, where algo.algo and recorder.Batch look for it
+	dirpath = tmp_path / "data"
+	dirpath.mkdir()
+	n = 3000
+	rng = np.random.default_rng(0)
+	price = np.round(150000 + np.cumsum(rng.normal(0, 800, n))).astype(np.int64)
+	time = pd.date_range("2018-01-01", periods=n, freq="20min")
+	pd.DataFrame({"time": time, "price": price}).to_csv(dirpath / FILE, index=False)
+	monkeypatch.chdir(tmp_path)
+	return dirpath
+
+
+class _Interrupt(Exception):
+	pass
+
+
+def _output(dirpath, mode):
+	# The recorded rows without their timings
+	fp = str(dirpath / "out.txt")
+	if mode == "npy":
+		df = recorder.load(fp)
+	elif mode == "log":
+		with recorder.LogReader(fp) as reader:
+			df = reader.read()
+	else:
+		df = pd.read_csv(fp)
+	return df.drop(columns="runtime")
+
+
+def _algo(checkpoint, mode="csv", start_gold=200000):
+	return algo.algo(file=FILE, start_regional=1000, region="EU", start_gold=start_gold, token=20,
+					outfile="out.txt", mode=mode, checkpoint=checkpoint, every=700)
+
+
+@pytest.mark.parametrize("mode", ["csv", "npy", "log"])
+def test_resume_matches_uninterrupted_run(data, monkeypatch, mode):
+	value = _algo(None, mode)
+	expected = _output(data, mode)
+	ck = str(data / "run.ckpt")
+
+	# Stop a run partway, after a few checkpoints and just after a batch is handed to
+	# the writer
+	record = recorder.Batch.record
+	calls = [0]
+	def interrupted(self, *args, **kwargs):
+		calls[0] += 1
+		if calls[0] == 1900:
+			raise _Interrupt
+		return record(self, *args, **kwargs)
+
+	# A slow disk, so the npy/log writer is still busy with it then
+	write = recorder.Batch._write_columns
+	def slow(self, *args):
+		sleep(0.05)
+		return write(self, *args)
+
+	threads = threading.active_count()
+	monkeypatch.setattr(recorder.Batch, "record", interrupted)
+	monkeypatch.setattr(recorder.Batch, "_write_columns", slow)
+	with pytest.raises(_Interrupt):
+		_algo(ck, mode)
+	monkeypatch.setattr(recorder.Batch, "record", record)
+	monkeypatch.setattr(recorder.Batch, "_write_columns", write)
+	assert os.path.exists(ck)
+	# The failed run's writer has finished and stopped
+	assert threading.active_count() == threads
+
+	# A checkpoint isn't resumed into a run with other parameters
+	with pytest.raises(ValueError):
+		_algo(ck, mode, start_gold=100000)
+
+	# Resumed in the same process, right after the interrupted run's writer
+	assert _algo(ck, mode) == value
+	pd.testing.assert_frame_equal(_output(data, mode), expected)
+
+	# A completed run leaves no checkpoint, so the next run starts over
+	assert not os.path.exists(ck)
+	assert _algo(ck, mode) == value
+
+
+def test_resume_keeps_summary(data, monkeypatch):
+	def run(checkpoint):
+		return algo.algo(file=FILE, start_regional=1000, region="EU", start_gold=200000, token=20,
+						outfile="out.txt", checkpoint=checkpoint, every=700, summary=True)
+
+	value, expected = run(None)
+	ck = str(data / "run.ckpt")
+
+	record = recorder.Batch.record
+	calls = [0]
+	def interrupted(self, *args, **kwargs):
+		calls[0] += 1
+		if calls[0] == 2500:
+			raise _Interrupt
+		return record(self, *args, **kwargs)
+
+	monkeypatch.setattr(recorder.Batch, "record", interrupted)
+	with pytest.raises(_Interrupt):
+		run(ck)
+	monkeypatch.setattr(recorder.Batch, "record", record)
+
+	resumed, summary = run(ck)
+	assert resumed == value
+	# Everything but the timings covers the whole run, not just the resumed rows
+	timings = [name for name in recorder.Summary.FIELDS if name.startswith("runtime")]
+	got, want = summary.as_dict(), expected.as_dict()
+	for name in timings:
+		del got[name], want[name]
+	assert got == want
+	assert summary.ticks == len(_output(data, "csv"))
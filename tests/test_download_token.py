@@ -0,0 +1,162 @@
+import hashlib
+import http.server
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import download_token as dt
+
+
+def _document(regions, n, t0=1500000000):
+	return json.dumps({region: [{"time": t0 + 1200*i, "price": 150000 + i} for i in range(n)]
+						for region in regions}).encode()
+
+
+class _Server:
+	'''
+	Local HTTP server for the downloader: serves 'docs' by path with ETags, answers
+	conditional requests with 304, fails the next fails[path] requests with 503, and
+	counts requests and the most it had in flight at once
+	'''
+	def __init__(self):
+		self.docs = {}
+		self.fails = {}
+		self.hits = {}
+		self.statuses = []
+		self.inflight = 0
+		self.max_inflight = 0
+		self.delay = 0.0
+		self._lock = threading.Lock()
+		server = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+
+			def log_message(self, *args):
+				pass
+
+			def do_GET(self):
+				with server._lock:
+					server.hits[self.path] = server.hits.get(self.path, 0) + 1
+					server.inflight += 1
+					server.max_inflight = max(server.max_inflight, server.inflight)
+				try:
+					time.sleep(server.delay)
+					self._respond()
+				finally:
+					with server._lock:
+						server.inflight -= 1
+
+			def _respond(self):
+				if server.fails.get(self.path, 0) > 0:
+					server.fails[self.path] -= 1
+					return self._send(503, headers={"Retry-After": "0"})
+				body = server.docs[self.path]
+				etag = f'"{hashlib.md5(body).hexdigest()}"'
+				if self.headers.get("If-None-Match") == etag:
+					return self._send(304, headers={"ETag": etag})
+				self._send(200, body, {"ETag": etag})
+
+			def _send(self, status, body=b"", headers={}):
+				server.statuses.append((self.path, status))
+				self.send_response(status)
+				for name, value in headers.items():
+					self.send_header(name, value)
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+		self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+		threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+	def url(self, path):
+		return self.base + path
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	# download() and download_all() write next to the scripts folder; keep them here
+	monkeypatch.setattr(dt, "connect_relative_dir", lambda *args, **kwargs: os.chdir(tmp_path))
+	s = _Server()
+	yield s
+	s.httpd.shutdown()
+
+
+def _csv(region):
+	return pd.read_csv(dt.csv_path(region))
+
+
+def test_fetch_all(server, tmp_path):
+	server.docs = {"/us": _document(["us"], 100), "/eu": _document(["eu"], 120),
+					"/flaky": _document(["kr", "eu"], 130)}
+	server.fails = {"/flaky": 2}
+	server.delay = 0.2
+	endpoints = {name: server.url(f"/{name}") for name in ("us", "eu", "flaky")}
+
+	result = dt.download_all(endpoints, backoff=0.01)
+	# Fetched side by side; the flaky endpoint recovered after its 503s
+	assert server.max_inflight >= 2
+	assert server.hits["/flaky"] == 3
+	assert result["us"] == {"us": 100}
+	assert result["flaky"]["kr"] == 130
+	# Regions shared by two endpoints are merged, whichever arrived first
+	assert len(_csv("eu")) == 130
+	assert len(_csv("kr")) == 130
+
+	# Nothing changed: every endpoint answers 304 and no files are touched
+	before = {path: os.path.getmtime(path) for path in os.listdir(tmp_path) if path.endswith(".csv")}
+	server.statuses.clear()
+	assert dt.download_all(endpoints, backoff=0.01) == {"us": None, "eu": None, "flaky": None}
+	assert sorted(status for path, status in server.statuses) == [304, 304, 304]
+	assert before == {path: os.path.getmtime(path) for path in before}
+
+	# Only the changed endpoint is downloaded again
+	server.docs["/us"] = _document(["us"], 150)
+	assert dt.download_all(endpoints, backoff=0.01) == {"us": {"us": 50}, "eu": None, "flaky": None}
+	df = _csv("us")
+	assert len(df) == 150
+	assert df["time"].is_monotonic_increasing
+	assert set(json.load(open(dt.CACHE))) == set(endpoints.values())
+
+	# Deleted files are downloaded again, though the server has nothing new
+	os.remove(dt.store_path("us"))
+	os.remove(dt.csv_path("us"))
+	os.remove(dt.csv_path("kr"))
+	assert dt.download_all(endpoints, backoff=0.01) == {"us": {"us": 150}, "eu": None, "flaky": {"kr": 130, "eu": 0}}
+	assert len(_csv("us")) == 150
+	assert len(_csv("kr")) == 130
+	assert len(np.fromfile(dt.store_path("kr"), dtype=dt.PRICE_DTYPE)) == 130
+
+
+def test_fetch_gives_up(server):
+	server.docs = {"/us": _document(["us"], 10)}
+	server.fails = {"/us": 10}
+	with pytest.raises(Exception):
+		dt.download_all({"us": server.url("/us")}, retries=2, backoff=0.01)
+	assert server.hits["/us"] == 3
+
+
+def test_download_appends(server):
+	server.docs = {"/history": _document(["us", "eu"], 100)}
+	assert dt.download(server.url("/history")) == {"us": 100, "eu": 100}
+	with open(dt.store_path("us"), "rb") as f:
+		first = f.read()
+
+	# A later history overlaps the stored one; only the newer prices are appended
+	server.docs["/history"] = _document(["us", "eu"], 160)
+	assert dt.download(server.url("/history")) == {"us": 60, "eu": 60}
+	assert dt.download(server.url("/history")) == {"us": 0, "eu": 0}
+
+	with open(dt.store_path("us"), "rb") as f:
+		assert f.read().startswith(first)
+	store = np.fromfile(dt.store_path("us"), dtype=dt.PRICE_DTYPE)
+	df = _csv("us")
+	assert len(store) == len(df) == 160
+	assert np.all(np.diff(store["time"]) > 0)
+	assert store["price"].tolist() == df["price"].tolist()
+	assert dt.last_time("us") == 1500000000 + 1200*159
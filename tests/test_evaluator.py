@@ -0,0 +1,27 @@
+import numpy as np
+import evaluator
+
+
+def _inputs(n, seed):
+	rng = np.random.default_rng(seed)
+	p1 = np.round(rng.uniform(20000, 300000, n))
+	# Mostly buy signals (p1 above p0) of every size, plus some that never buy
+	p0 = p1 - rng.exponential(3000, n) * rng.choice([1, 1, 1, -1], n)
+	# Ceilings from a fraction of a token to past 2/cr, where solve falls back to bisect
+	scale = rng.choice([2, 500, 3e5], n)
+	xb = rng.uniform(0.001, 1, n) * scale
+	return p0, p1, xb
+
+
+def test_solve_matches_bisect():
+	for seed in range(4):
+		p0, p1, xb = _inputs(5000, seed)
+		volume = evaluator.Opt.solve(p0, p1, xb)
+		expected = [evaluator.Opt.bisect(p0=a, p1=b, xb=c) for a, b, c in zip(p0.tolist(), p1.tolist(), xb.tolist())]
+		assert volume.tolist() == expected
+
+
+def test_solve_broadcasts():
+	volume = evaluator.Opt.solve(p0=[140000.0, 150000.0], p1=150000.0, xb=50.0)
+	assert volume.shape == (2,)
+	assert volume[1] == evaluator.Opt.bisect(p0=150000.0, p1=150000.0, xb=50.0)
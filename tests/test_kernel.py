@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import engine
+import kernel
+from model import ARIMA
+
+COLUMNS = ["market_price", "prediction", "tradeprice", "volume", "regionbank", "wowbank", "taper"]
+
+JITS = [False, pytest.param(True, marks=pytest.mark.skipif(not kernel.JIT, reason="numba not installed"))]
+
+
+def _series(seed, n=2000):
+	rng = np.random.default_rng(seed)
+	return np.maximum(np.round(150000 + rng.normal(0, 4000, n) + np.cumsum(rng.normal(0, 300, n))), 1)
+
+
+def _assert_same(result, expected):
+	for name in COLUMNS:
+		assert result[name].to_numpy().tolist() == expected[name].to_numpy().tolist(), name
+	assert result["trade"].cat.codes.tolist() == expected["trade"].cat.codes.tolist()
+
+
+@pytest.mark.parametrize("jit", JITS)
+def test_matches_engine(jit):
+	for seed in range(5):
+		price = _series(seed)
+		_assert_same(kernel.backtest(price, 1000, 200000, 20, jit=jit), engine.backtest(price, 1000, 200000, 20))
+
+
+@pytest.mark.parametrize("jit", JITS)
+def test_matches_engine_tapered(jit):
+	# Little gold, so most sales can't be covered in full
+	tapered = 0
+	for seed in range(20):
+		price = _series(seed)
+		expected = engine.backtest(price, 50000, 100, 20)
+		tapered += expected["taper"].sum()
+		_assert_same(kernel.backtest(price, 50000, 100, 20, jit=jit), expected)
+	assert tapered > 0
+
+
+@pytest.mark.parametrize("jit", JITS)
+def test_blocks(jit):
+	price = _series(0)
+	loop = kernel.Loop(1000, 200000, 20, jit=jit)
+	parts = [loop.run(price[i:i+333]) for i in range(0, len(price), 333)]
+	whole = kernel.backtest(price, 1000, 200000, 20, jit=jit)
+	for name in COLUMNS:
+		assert np.concatenate([part[name].to_numpy() for part in parts])[loop.warmup:].tolist() == whole[name].tolist()
+
+
+@pytest.mark.parametrize("jit", JITS)
+def test_matches_engine_high_order(jit):
+	rng = np.random.default_rng(7)
+	for p, q in ((8, 8), (9, 3), (12, 12)):
+		ar, ma = rng.normal(0, 0.15, p), rng.normal(0, 0.15, q)
+		price = _series(p + q)
+		_assert_same(kernel.backtest(price, 1000, 200000, 20, model=ARIMA(ar, ma), jit=jit),
+					engine.backtest(price, 1000, 200000, 20, model=ARIMA(ar, ma)))
@@ -0,0 +1,32 @@
+import asyncio
+import numpy as np
+import pandas as pd
+import engine
+import live
+import recorder
+
+
+def _series(n=2000, seed=0):
+	rng = np.random.default_rng(seed)
+	price = np.round(150000 + np.cumsum(rng.normal(0, 800, n)))
+	time = pd.date_range("2018-01-01", periods=n, freq="20min").astype(str).tolist()
+	return time, price
+
+
+def test_socket_feed_matches_engine():
+	time, price = _series()
+	trader = live.Trader(1000, "EU", 200000, 20)
+	records = recorder.History(capacity=16)
+
+	async def main():
+		server = await live.serve(time, price.tolist())
+		port = server.sockets[0].getsockname()[1]
+		async with server:
+			return await live.run(live.connect("127.0.0.1", port), trader, records, maxsize=64)
+
+	latency = asyncio.run(main())
+	expected = engine.backtest(price, 1000, 200000, 20)
+	assert trader.value == engine.final_value(expected, 20)
+	assert latency.count == len(expected)
+	assert records.rows["wowbank"].tolist() == expected["wowbank"].tolist()
+	assert records.rows["regionbank"].tolist() == expected["regionbank"].tolist()
@@ -0,0 +1,57 @@
+import numpy as np
+import model
+import montecarlo
+
+
+def _arma(ar, ma, n, seed):
+	# d_t = ar*d_(t-1) + ma*e_(t-1) + e_t, the sign convention of model.fit
+	rng = np.random.default_rng(seed)
+	e = rng.normal(0, 1, n)
+	d = np.zeros(n)
+	for t in range(1, n):
+		d[t] = ar*d[t-1] + ma*e[t-1] + e[t]
+	return d
+
+
+def test_initial_ma_sign():
+	for ma in (0.4, -0.4):
+		a, m = model._initial(_arma(0.6, ma, 20000, seed=0), 1, 1)
+		assert abs(a[0] - 0.6) < 0.05
+		assert abs(m[0] - ma) < 0.05
+
+
+def test_filter_matches_next():
+	rng = np.random.default_rng(3)
+	price = np.round(150000 + np.cumsum(rng.normal(0, 800, 3000)))
+	# sum() reduces 8 or more terms pairwise; the orders around that must still agree
+	for p, q in ((5, 5), (8, 8), (9, 2), (12, 12)):
+		ar, ma = rng.normal(0, 0.15, p), rng.normal(0, 0.15, q)
+		single = model.ARIMA(ar, ma)
+		expected = [single.next(value) for value in price.tolist()]
+		assert model.ARIMA(ar, ma).filter(price).tolist() == expected
+		assert montecarlo.predict_paths(np.tile(price, (2, 1)), model.ARIMA(ar, ma)).tolist() == [expected]*2
+
+
+def test_ensemble_rows_match_arima():
+	price = np.round(150000 + np.cumsum(np.random.default_rng(1).normal(0, 800, 3000)))
+	params = [(model.ARIMA().ar_params, model.ARIMA().ma_params), ([0.5, -0.1], [0.3]), ([0.1, 0.2, 0.3], []),
+			([], [0.4, 0.1]), ([0.2]*7, [0.1, -0.1, 0.05]), ([0.05]*9, [0.1, -0.05]*6)]
+	combined, rows = model.Ensemble(params, combine="best").filter(price, full=True)
+	for i, (ar, ma) in enumerate(params):
+		single = model.ARIMA(ar, ma)
+		assert rows[:, i].tolist() == [single.next(p) for p in price.tolist()]
+
+	ensemble = model.Ensemble(params, combine="best")
+	assert [ensemble.next(p) for p in price.tolist()] == combined.tolist()
+
+
+def test_fit_more_ma_than_ar_lags():
+	for p, q, ar, ma in ((0, 2, [], [0.5, 0.2]), (1, 2, [0.4], [0.5, 0.2]), (1, 3, [0.4], [0.3, 0.2, 0.1])):
+		rng = np.random.default_rng(p + q)
+		e = rng.normal(0, 1, 20000)
+		d = e.copy()
+		for t in range(3, len(d)):
+			d[t] += sum(a*d[t-1-k] for k, a in enumerate(ar)) + sum(m*e[t-1-k] for k, m in enumerate(ma))
+		result = model.fit(np.concatenate(([0.0], np.cumsum(d))), p, q)
+		assert np.allclose(result.ar_params, ar, atol=0.05)
+		assert np.allclose(result.ma_params, ma, atol=0.05)
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import numpy as np
+import recorder
+
+T0 = np.datetime64("2020-01-01T00:00:00", "ns")
+
+
+def _rows(start, n):
+	rows = np.zeros(n, dtype=recorder.RECORD_DTYPE)
+	rows["time"] = T0 + np.arange(start, start + n) * np.timedelta64(60, "s")
+	rows["market_price"] = 150000 + np.arange(start, start + n)
+	rows["volume"] = np.arange(start, start + n)
+	return rows
+
+
+def _write(fp, blocks, size=100, segment_size=1 << 26):
+	# 'blocks' blocks of 'size' rows, one minute apart
+	recorder.LogWriter.reset(fp)
+	with recorder.LogWriter(fp, segment_size=segment_size) as writer:
+		for k in range(blocks):
+			writer.append(_rows(k*size, size))
+	return _rows(0, blocks*size)
+
+
+def test_range_queries_across_segments(tmp_path):
+	fp = str(tmp_path / "log")
+	rows = _write(fp, 40, segment_size=2000)
+	with recorder.LogReader(fp) as reader:
+		assert len(set(reader.index()["segment"].tolist())) > 5
+		assert reader.rows().tolist() == rows.tolist()
+		for start, end in ((0, 1), (99, 101), (150, 2350), (3999, 4000), (1234, 9999)):
+			window = reader.rows(T0 + np.timedelta64(start, "m"), T0 + np.timedelta64(end, "m"))
+			assert window["volume"].tolist() == list(range(start, min(end, 4000)))
+		# Open sides, and bounds as epoch seconds
+		epoch = int(T0.astype("datetime64[s]").astype(np.int64))
+		assert reader.rows(start=epoch + 60*3950)["volume"].tolist() == list(range(3950, 4000))
+		assert reader.rows(end=epoch + 60*5)["volume"].tolist() == list(range(5))
+		assert len(reader.rows(T0 - np.timedelta64(1, "D"), T0)) == 0
+
+
+def test_reset_to_position(tmp_path):
+	fp = str(tmp_path / "log")
+	_write(fp, 40, segment_size=2000)
+	entries = recorder.LogReader(fp).index()
+	keep = 23
+	recorder.LogWriter.reset(fp, keep * recorder.INDEX_DTYPE.itemsize)
+
+	last = int(entries[keep - 1]["segment"])
+	segments = sorted(name for name in os.listdir(fp) if name.endswith(".seg"))
+	assert segments[-1] == recorder.SEGMENT.format(last)
+	assert os.path.getsize(os.path.join(fp, segments[-1])) == entries[keep - 1]["offset"] + entries[keep - 1]["length"]
+	with recorder.LogReader(fp) as reader:
+		assert reader.rows()["volume"].tolist() == list(range(keep*100))
+
+	# A writer carries on from the cut
+	with recorder.LogWriter(fp, segment_size=2000) as writer:
+		for k in range(keep, 40):
+			writer.append(_rows(k*100, 100))
+	with recorder.LogReader(fp) as reader:
+		assert reader.rows().tolist() == _rows(0, 4000).tolist()
+		assert reader.index()[["segment", "offset", "length"]].tolist() == entries[["segment", "offset", "length"]].tolist()
+
+
+def test_read_while_writing(tmp_path):
+	fp = str(tmp_path / "log")
+	recorder.LogWriter.reset(fp)
+	blocks, size = 300, 50
+	done = threading.Event()
+
+	def write():
+		with recorder.LogWriter(fp, segment_size=4000) as writer:
+			for k in range(blocks):
+				writer.append(_rows(k*size, size))
+				time.sleep(0.001)
+		done.set()
+
+	thread = threading.Thread(target=write)
+	thread.start()
+	seen = []
+	with recorder.LogReader(fp) as reader:
+		while not done.is_set():
+			rows = reader.rows()
+			# Always whole blocks, in order, from the start of the log
+			assert len(rows) % size == 0
+			assert rows["volume"].tolist() == list(range(len(rows)))
+			seen.append(len(rows))
+		thread.join()
+		assert len(reader.rows()) == blocks*size
+	assert seen == sorted(seen)
+	assert len(set(seen)) > 1
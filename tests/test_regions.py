@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+import regions
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+	dirpath = tmp_path / "data"
+	dirpath.mkdir()
+	monkeypatch.chdir(tmp_path)
+	return dirpath
+
+
+def _prices(fp, n, seed):
+	rng = np.random.default_rng(seed)
+	price = np.round(150000 + np.cumsum(rng.normal(0, 800, n))).astype(np.int64)
+	time = pd.date_range("2018-01-01", periods=n, freq="20min")
+	pd.DataFrame({"time": time, "price": price}).to_csv(fp, index=False)
+
+
+def test_run(data):
+	_prices(data / "eu-token-full.csv", 1000, 0)
+	_prices(data / "kr-token-full.csv", 1000, 1)
+	# Too short to trade
+	_prices(data / "us-token-full.csv", 3, 2)
+
+	table = regions.run(start_regional={"EU": 1000, "KR": 30000, "US": 1000}, start_gold=200000, token=20,
+						workers=1).set_index("region")
+	assert table.loc[["EU", "KR"], "error"].isna().all()
+	assert table.loc["US", "error"] is not None
+	# Regions are in their own currencies, so only the returns are combined
+	assert np.isnan(table.loc["ALL", "start_value"]) and np.isnan(table.loc["ALL", "final_value"])
+	assert table.loc["ALL", "return"] == pytest.approx(table.loc[["EU", "KR"], "return"].mean())
+
+
+def test_summarize_without_results():
+	failed = regions.summarize(pd.DataFrame([{"region": "EU", "error": "ValueError: no prices"}]))
+	assert failed["region"].tolist() == ["EU", "ALL"]
+	assert failed.loc[0, "error"] == "ValueError: no prices"
+	assert np.isnan(failed.loc[1, "return"])
+
+	assert regions.summarize(pd.DataFrame([]))["region"].tolist() == ["ALL"]
@@ -0,0 +1,41 @@
+import numpy as np
+import evaluator
+import settlement
+
+
+def _unit_steps(price, volume, gold):
+	# The original taper: drop one unit at a time until the sale is covered
+	cost = evaluator.Opt.sell_price(price, volume) * volume
+	while cost > gold:
+		volume -= 1
+		cost = evaluator.Opt.sell_price(price, volume) * volume
+	return volume
+
+
+def test_affordable_matches_unit_steps():
+	rng = np.random.default_rng(0)
+	for i in range(20000):
+		price = float(np.round(rng.uniform(20000, 300000)))
+		volume = int(rng.integers(1, 3000))
+		# Gold around the cost of the whole sale, down to nothing
+		gold = float(rng.uniform(0, 1.2) * evaluator.Opt.sell_price(price, volume) * volume)
+		if rng.random() < 0.1:
+			# Exactly the cost of some smaller volume, the boundary case
+			v = int(rng.integers(0, volume))
+			gold = evaluator.Opt.sell_price(price, v) * v
+		expected = _unit_steps(price, volume, gold)
+		if expected == volume:
+			continue
+		assert settlement.affordable(price, volume, gold) == expected
+
+
+def test_sell_tapers_like_unit_steps():
+	price, volume = 150000.0, 40
+	gold = 25*price
+	tprice = evaluator.Opt.sell_price(price, volume)
+	regional, left, sold, trade_price, taper = settlement.sell(price, volume, tprice, 20, 0.0, gold)
+	assert sold == _unit_steps(price, volume, gold)
+	assert taper == volume - sold
+	assert trade_price == evaluator.Opt.sell_price(price, sold)
+	assert left == gold - trade_price*sold
+	assert regional == 20*sold